@@ -17,7 +17,10 @@ investorCount = 0  # The number of the investors
 investorsVotes = investorEquity * investorCount  # The total quity of the node investors which is used in the reward calculation
 
 tx_fee = 10 ** 4  # The transaction fee
+tx_fee_per_kb = 0  # The fee per 1000 bytes of the transactions in sela. If it is 0, the transactions of a distribution share 'tx_fee' in proportion to their sizes
+tx_max_size = 100000  # The size limit of a transaction in bytes, a larger distribution is split into several transactions
 operating_costs = 0  # cost for server, it will be deducted in each round, in sela
+reward_integer_mode = False  # Allocate the reward in sela exactly with integer arithmetic instead of float
 
 ########## Need to modify the parameters of the node before the first run ##########
 dposRewardAddress = "ElaAddress"  # The dpos node's reward address
@@ -33,6 +36,11 @@ address = "ElaAddresses0000000000000000000000"  # The address used to distribute
 public_key = "Public Key"  # The public key of the address above
 private_key = "Private Key"  # The private key of the address above
 
+# To distribute the dpos reward of several nodes in one process, add a profile for each node to the list below, e.g.
+# {"name": "node1", "dposRewardAddress": "", "ownerPublicKey": "", "address": "", "public_key": "", "private_key": ""}
+# The record files of each node are prefixed with its name. If the list is empty, the parameters above are used.
+producers = []
+
 investor_a = ""  # The inverstors' addresses used to receive the reward.
 
 # If there are more than one investor, just add investor's address and his investorEquity to the dict below
@@ -44,6 +52,34 @@ H2 = 402680  # This is the height of the DPOS consensus, please do not modify
 api_mist_url = "https://api-wallet-ela.elastos.org"  # api server's domain name
 distribution_record_file = "distribute_record.csv"  # The file for the distribution record
 dpos_record_file = "dpos_record.csv"  # The file for the dpos reward record
+scan_state_file = "scan_state.json"  # The checkpoint of the dpos record scanner
 log_path = "logs"  # The configuration for log
 tx_path = "txs"  # The path to store the transaction
 Memo_Prefix = "type:text,msg:"
+
+########## The parameters about the performance of the program ##########
+fetch_workers = 8  # The number of threads used to fetch blocks from the node
+fetch_window = 64  # The number of blocks which can be prefetched ahead of the block being checked
+rpc_batch_size = 16  # The number of rpc calls sent to the node in one batch request
+sign_workers = 4  # The number of threads used to sign the transactions of a distribution
+crypto_backend = "auto"  # "auto", "openssl" or "python". "auto" uses OpenSSL if the package cryptography is installed
+vote_fetch_workers = 8  # The max number of the concurrent requests to the vote api
+raw_block_fetch = False  # Fetch the raw blocks and decode the coinbase transactions locally instead of the json blocks
+http_pool_size = 16  # The max number of the connections kept alive for the node and the api server separately
+http_keep_alive = True  # Reuse the connections to the node and the api server
+http_timeout = 60  # The timeout of each http request, in seconds
+checkpoint_interval = 100  # The scan checkpoint is saved at least once every this number of blocks
+# Only check the block 36 blocks after the last dpos reward, and scan the gap when there is no reward there.
+# A second ForceChange that lands exactly 36 blocks after the last dpos reward can't be detected in this mode.
+dpos_probe_scan = False
+follow_poll_min = 2  # The min interval of polling the best block in the follow mode, in seconds
+follow_poll_max = 30  # The max interval of polling the best block in the follow mode, in seconds
+cache_file = "cache.db"  # The local cache of the blocks and the votes
+cache_confirmations = 6  # Only the blocks with at least this number of confirmations are cached
+rank_index_size = 256  # The number of the heights whose producer rank are kept in memory
+voter_delta_depth = 32  # The max number of the voter deltas stored after a full voter snapshot
+address_cache_size = 65536  # The number of the addresses whose program hashes are kept in memory
+utxo_tracker = True  # Track the utxos of the distribution address in the cache and select the inputs locally
+utxo_consolidate = False  # Sweep the dust utxos of the distribution address into one while idle in the follow mode
+utxo_dust_value = 10 ** 6  # The utxos less than it are dust, in sela
+utxo_consolidate_count = 20  # The min number of the dust utxos to be swept
@@ -9,25 +9,118 @@
 @time: 2019-07-02 21:31
 """
 
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import random
 import time
 
 import config as cf
 from utility.util import DEBUG, WARNING, ERROR
 from wallet import transaction as t
-from utility import util, request, encoding
+from utility import util, request, encoding, reward, cache
+from utility.serialize import Serialize
 
 
-def distributeReward(lastDistributeRound: int, lastDistributeHeight: int):
+class DistributionError(Exception):
+    """ Log and raise the errors which abort a distribution """
+
+    def __init__(self, msg=''):
+        self.msg = msg
+        util.feedback(content=msg, level=ERROR, module="DPS")
+
+    def __str__(self):
+        return self.msg
+
+
+def distributeReward(lastDistributeRound: int, lastDistributeHeight: int, producer=None):
     """
     Calculate the vote for each address and create a transaction to distribute the dpos reward based on that situation.
     :param lastDistributeRound: The index of the dpos reward distribution round
     :param lastDistributeHeight: The height of the last dpos reward distribution
+    :param producer: The profile of the dpos node, see util.getProducers
     :return: None
     """
+    producer = util.getProducer(producer)
+    plan = calculateDistribution(lastDistributeRound, lastDistributeHeight, producer)
+    if plan["reward"] == 0:
+        util.feedback(content="There's no dpos reward in this distribution round, bye!", level=WARNING, module="DPS")
+        writeEmptyDistribution(plan, producer)
+        return
+
+    # 3. Create and sign the transactions
+    inputs, utxoAmount, inputValues = getDistributionInputs([plan], producer)
+    shards, _, _ = buildDistributionTxs(plan, inputs, utxoAmount, producer, inputValues)
+
+    # 4. Send transactions to the node
+    sendDistributionTxs(plan, shards, producer)
+    # 5. Waiting for a node to package the transactions
+    waitForConfirmations(shards)
+
+
+def distributeCycles(lastDistributeRound: int, lastDistributeHeight: int, cycles: int, producer=None):
+    """
+    Distribute several cycles of the dpos reward at once. The transactions are built back-to-back, each one spends
+    the change output of the previous one, so they can be sent as a chain and confirmed together.
+    :param lastDistributeRound: The index of the dpos reward distribution round
+    :param lastDistributeHeight: The height of the last dpos reward distribution
+    :param cycles: The number of the cycles to distribute
+    :param producer: The profile of the dpos node, see util.getProducers
+    :return: None
+    """
+    producer = util.getProducer(producer)
+    if cycles == 1:
+        distributeReward(lastDistributeRound, lastDistributeHeight, producer)
+        return
+
+    # 1. Calculate the distribution of all pending cycles up front
+    plans = []
+    for _ in range(cycles):
+        _plan = calculateDistribution(lastDistributeRound, lastDistributeHeight, producer)
+        plans.append(_plan)
+        lastDistributeRound, lastDistributeHeight = _plan["round"], _plan["height"]
+    _payments = [_plan for _plan in plans if _plan["reward"] != 0]
+
+    # 2. Create and sign the chain of transactions, the change of each transaction is the input of the next one
+    txs = {}
+    if len(_payments) > 0:
+        inputs, utxoAmount, inputValues = getDistributionInputs(_payments, producer)
+        for _plan in _payments:
+            _shards, _changeIndex, utxoAmount = buildDistributionTxs(_plan, inputs, utxoAmount, producer, inputValues)
+            inputs = [t.TxInput(txid=_shards[-1]["txid"], index=_changeIndex)]
+            txs[_plan["round"]] = _shards
+
+    # 3. Send the transactions in order, the records are written in the order of the cycles
+    for _plan in plans:
+        if _plan["reward"] == 0:
+            util.feedback(content=f"There's no dpos reward in the distribution round[{_plan['round']}].",
+                          level=WARNING, module="DPS")
+            writeEmptyDistribution(_plan, producer)
+        else:
+            sendDistributionTxs(_plan, txs[_plan["round"]], producer)
+
+    # 4. Waiting for a node to package the transactions
+    if len(_payments) > 0:
+        waitForConfirmations([_shard for _plan in _payments for _shard in txs[_plan["round"]]])
+
+
+def calculateDistribution(lastDistributeRound: int, lastDistributeHeight: int, producer=None) -> dict:
+    """
+    Calculate the reward of each voter in the next distribution cycle.
+    :param lastDistributeRound: The index of the dpos reward distribution round
+    :param lastDistributeHeight: The height of the last dpos reward distribution
+    :param producer: The profile of the dpos node, see util.getProducers
+    :return: A dict
+        round: the index of this distribution round
+        height: the height of the last dpos reward in this distribution round
+        message: the distribution message in the memo
+        reward: the total amount of the dpos reward in sela
+        receivers: key: the voter's address, value: the reward in sela
+        amount: the amount of the distribution in sela
+    """
+    producer = util.getProducer(producer)
     # 1. Calculate the distribution of reward per round
-    # key: the index of the reward round
-    rewardInRound = {}
+    # the votes of the rounds with the dpos reward
+    rewardInRound = reward.RewardMatrix()
     # The total amount of the dpos reward
     rewardTotal = 0
 
@@ -40,7 +133,7 @@ def distributeReward(lastDistributeRound: int, lastDistributeHeight: int):
                   module="DPS")
 
     # fetch the dpos reward records from 'dpos_record.csv'
-    dposRecord = util.getDposRecord(firstDposRound, lastDposRound)
+    dposRecord = util.getDposRecord(firstDposRound, lastDposRound, producer)
     util.feedback(content=dposRecord.__str__(), module="DPS")
 
     # Calculate the block range for this dpos reward distribution
@@ -48,6 +141,13 @@ def distributeReward(lastDistributeRound: int, lastDistributeHeight: int):
     lastBLock = dposRecord[lastDposRound]["dposHeight"] - 1
     distributionMsg = "Height[{} ~ {}] {}".format(firstBlock, lastBLock, util.get_block_date(lastBLock))
     util.feedback(content=f"Distribution Message:[{distributionMsg}]", module="DPS")
+    plan = {"round": lastDistributeRound + 1, "height": dposRecord[lastDposRound]["dposHeight"],
+            "message": distributionMsg, "reward": 0, "receivers": {}, "amount": 0}
+
+    # fetch the voters of all rounds with the dpos reward up front
+    _voteHeights = [dposRecord[i]["voteHeight"] for i in range(firstDposRound, lastDposRound + 1) if
+                    dposRecord[i]["reward"] != 0]
+    votesByHeight = util.prefetchVotesByHeight(ownerPb=producer["ownerPublicKey"], heights=_voteHeights)
 
     for i in range(firstDposRound, lastDposRound + 1):
         _record = dposRecord[i]
@@ -61,41 +161,26 @@ def distributeReward(lastDistributeRound: int, lastDistributeHeight: int):
         if _amount == 0:
             continue
         else:
-            _amountToDistribute = (_amount - cf.operating_costs) * cf.distribution_percent
-            _voters = util.getVotersByHeight(ownerPb=cf.ownerPublicKey, hei=_voterHeight)
-            _totalVotes = util.getTotalVotesByHeight(ownerPb=cf.ownerPublicKey, hei=_voterHeight)
+            _amountToDistribute = reward.amount_to_distribute(_amount)
+            _voters, _totalVotes = votesByHeight[_voterHeight]
 
             if _voters is None:
-                util.feedback(content="Get Voters' Information ERROR!", level=ERROR, module="DPS")
-                exit(1)
+                raise DistributionError("Get Voters' Information ERROR!")
 
-            _receiptor = util.caleRewardByVoter(
-                _amountToDistribute, _voters, totalVotes=_totalVotes)
-            _distributionThisRound = util.calDistributionAmount(_receiptor)
-            util.feedback(content=f"The amound of distribution is {util.SelaToEla(_distributionThisRound)}",
-                          module="DPS")
-            util.feedback(
-                content="The percent of distribution is {:.2%}".format(_distributionThisRound / _amount), module="DPS")
+            rewardInRound.add_round(i, _amountToDistribute, _voters, totalVotes=_totalVotes)
             util.feedback(content=f"Total votes is {util.SelaToEla(_totalVotes)}", module="DPS")
-            rewardInRound[i] = _receiptor
-            _receiptor = {}
     if rewardTotal == 0:
-        util.feedback(content="There's no dpos reward in this distribution round, bye!", level=WARNING, module="DPS")
-        util.write_distribution_record(round=lastDistributeRound + 1, hei=dposRecord[lastDposRound]["dposHeight"],
-                                       amount="0", txid="xxxxxxxxxxxxxxxxxxxx", fee=0)
-        exit(0)
+        return plan
 
     # 2. Summary of n rounds of reward distribution
-    receivers = {}  # key:address,value:reward for vote
-    for i in range(firstDposRound, lastDposRound + 1):
-        if i not in rewardInRound.keys():
-            continue
-        for _add in rewardInRound[i].keys():
-            util.feedback(content=f"round[{i}] {_add} reward {rewardInRound[i][_add]}", level=DEBUG, module="DPS")
-            if _add not in receivers.keys():
-                receivers[_add] = rewardInRound[i][_add]
-            else:
-                receivers[_add] += rewardInRound[i][_add]
+    # receivers, key:address,value:reward for vote
+    receivers, _distributionInRound = rewardInRound.calculate()
+    for i, _distributionThisRound in _distributionInRound.items():
+        _amount = dposRecord[i]["reward"]
+        util.feedback(content=f"Round[{i}] the amound of distribution is {util.SelaToEla(_distributionThisRound)}",
+                      module="DPS")
+        util.feedback(
+            content="The percent of distribution is {:.2%}".format(_distributionThisRound / _amount), module="DPS")
     amountDistribute = 0
     addCount_temp = 0
     addressRemoved = []  # The list of addresses with no voting reward
@@ -116,100 +201,500 @@ def distributeReward(lastDistributeRound: int, lastDistributeHeight: int):
         assert _value < 1
         assert _add not in receivers.keys()
 
-    amountDistribution_str = util.SelaToEla(amountDistribute)
-
-    util.feedback(content="The amount of distribution:{}, the number of reward:{}".format(amountDistribution_str,
-                                                                                          util.SelaToEla(rewardTotal)),
-                  module="DPS")
+    util.feedback(content="The amount of distribution:{}, the number of reward:{}".format(
+        util.SelaToEla(amountDistribute), util.SelaToEla(rewardTotal)), module="DPS")
     util.feedback(content=f"Distribution Percent:{amountDistribute / rewardTotal * 100}%", module="DPS")
+    plan.update(reward=rewardTotal, receivers=receivers, amount=amountDistribute)
+    return plan
 
-    # 3. Create and sign the transaction
-    _balance = request.get_balance(cf.address)
-    util.feedback(content=f"ADD[{cf.address}]'s balance is {_balance}", module="DPS")
-    if util.strElaToIntSela(_balance) < amountDistribute + cf.tx_fee:
-        util.feedback(
-            content="The balance of [{}:{}] is not enough to pay to voters in {}, require {}".format(cf.address,
-                                                                                                     _balance,
-                                                                                                     distributionMsg,
-                                                                                                     util.SelaToEla(
-                                                                                                         amountDistribute)),
-            level=ERROR, module="DPS")
-        exit(2)
+
+def getDistributionInputs(plans: list, producer: dict):
+    """
+    Check the balance of the distribution address and get the utxos to pay for the distributions.
+    :param plans: The distributions to pay, see calculateDistribution
+    :param producer: The profile of the dpos node, see util.getProducers
+    :return: The inputs of the transaction, their amount in sela, and a dict of the value of each input keyed by the
+        txid and the index
+    """
+    _address = producer["address"]
+    _amount = sum(_plan["amount"] for _plan in plans)
+    _required = _amount + sum(estimateDistributionFee(_plan, producer) for _plan in plans)
+    _utxos = syncUtxos(_address) if cf.utxo_tracker else None
+    if _utxos is not None:
+        _balance = util.SelaToEla(sum(_value for _, _, _value in _utxos))
+    else:
+        _balance = request.get_balance(_address)
+    util.feedback(content=f"ADD[{_address}]'s balance is {_balance}", module="DPS")
+    if util.strElaToIntSela(_balance) < _required:
+        raise DistributionError("The balance of [{}:{}] is not enough to pay to voters in {}, require {}".format(
+            _address, _balance, " ".join(_plan["message"] for _plan in plans), util.SelaToEla(_amount)))
     util.feedback(content="Preparing to build transaction", module="DPS")
     # Get utxo
-    _utxos = request.get_utxos_by_amount(address=cf.address, amount=util.SelaToEla(amountDistribute + cf.tx_fee))
+    if _utxos is not None:
+        _selected = selectUtxos(_utxos, _required)
+        if _selected is None:
+            raise DistributionError(f"The utxos of [{_address}] are not enough to pay the fee of the inputs")
+        util.feedback(content=f"{len(_selected)} of {len(_utxos)} utxos are selected", module="DPS")
+        _utxos = [{"txid": _txid, "vout": _vout, "amount": util.SelaToEla(_value)} for _txid, _vout, _value in
+                  _selected]
+    else:
+        _utxos = request.get_utxos_by_amount(address=_address, amount=util.SelaToEla(_required))
 
     # Create input
-    inputs, utxoAmount = util.gen_intput_by_utxo(utxos=_utxos)
-
-    # Create output
-    _changeValue = utxoAmount - amountDistribute - cf.tx_fee
-    outputs = util.gen_output_by_receiver(receivers)
-    _changeOutput = t.TxOutput(address=cf.address, value=_changeValue)
-    outputs.append(_changeOutput)
-
-    # Disrupt tx_outputs order
-    random.shuffle(outputs)
-
-    # Create the transaction, include memo, attributes
-    data_memo = f"{cf.Memo_Prefix}{cf.MsgForMemo} {distributionMsg}".encode()
-    attr = t.Attribute(usage=t.AttributeUsage_Memo, data=data_memo)
-    tx_distribution = t.Transaction(inputs=inputs, outputs=outputs, attributes=[attr])
-    txid_infile = encoding.bytes_to_hexstring(data=tx_distribution.hash(), reverse=True)
-    util.feedback(content=f"Txid is [{txid_infile}] before signed.", module="DPS")
-
-    # Sign the transactriron
-    _code = encoding.get_code_from_pb(cf.public_key)
-    _parameter = t.ecdsa_sign(cf.private_key, data=tx_distribution.serialize_unsigned()).hex()
-    tx_distribution.programs = [t.Program(code=_code, parameter=_parameter)]
-
-    # Serialize the transaction to get the raw data of the transaction
-    raw_tx = tx_distribution.serialize().hex()
-    util.write_tx_to_file(rawtx=raw_tx, txid=txid_infile)
-    util.feedback(content=f"RawTx:[{raw_tx}]", level=DEBUG, module="DPS")
-
-    # Update the distribution record before sending the transaction
-    util.write_distribution_record(round=lastDistributeRound + 1, hei=dposRecord[lastDposRound]["dposHeight"],
-                                   amount=amountDistribution_str, txid=txid_infile,
-                                   fee=cf.tx_fee)
-
-    # 4. Send transaction to the node
-    txid_returned = request.send_tx(raw_tx=raw_tx)
-
-    if txid_returned != txid_infile:
-        util.feedback(content=f"Send TX ERROR!txid:[{txid_infile}], return:[{txid_returned}]", level=ERROR,
+    inputs, amount = util.gen_intput_by_utxo(utxos=_utxos)
+    inputValues = {(_utxo["txid"], _utxo["vout"]): util.strElaToIntSela(_utxo["amount"]) for _utxo in _utxos}
+    return inputs, amount, inputValues
+
+
+def syncUtxos(address: str):
+    """
+    Synchronize the tracked utxos of the address with the node. The pending transactions sent by this program are
+    looked up on the node, and the ones dropped by the node are released, see UtxoSet.release.
+    :param address: The distribution address
+    :return: A list of the txid, the index and the value in sela of the unspent utxos, None if the node fails to list
+        the utxos
+    """
+    try:
+        _listed = request.get_unspent_utxos(address)
+    except Exception as e:
+        _listed = None
+        util.feedback(content=f"Failed to list the utxos of [{address}]: {e}", level=WARNING, module="DPS")
+    if _listed is None:
+        util.feedback(content="The utxos are not tracked, get them from the node by amount", level=WARNING,
                       module="DPS")
-        exit(2)
-    else:
-        time_str = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time()))
-        _height = request.get_block_height()
-        util.feedback(content=f"[{time_str}]Tx[{txid_returned}] is send to node, height[{_height}].", module="DPS")
-    # 5. Waiting for a node to package the transaction
-    util.feedback(content="Wait for wallet be confirmed.", module="DPS")
+        return None
+    utxoSet = cache.get_utxo_set()
+    utxoSet.sync(address, [(_utxo["txid"], _utxo["vout"], util.strElaToIntSela(_utxo["amount"])) for _utxo in
+                           _listed])
+    for _txid in utxoSet.pending(address):
+        try:
+            _dropped = request.get_tx(tx_id=_txid) is None
+        except Exception as e:
+            util.feedback(content=f"Failed to get Tx[{_txid}]: {e}", level=WARNING, module="DPS")
+            continue
+        if _dropped:
+            util.feedback(content=f"Tx[{_txid}] is dropped by the node, its utxos are released", level=WARNING,
+                          module="DPS")
+            utxoSet.release(address, _txid)
+    return utxoSet.unspent(address)
+
+
+def selectUtxos(utxos: list, amount: int):
+    """
+    Select the fewest utxos to pay the amount, and the fee of the inputs beyond the first one which the estimated fee
+    doesn't include.
+    :param utxos: The unspent utxos, see syncUtxos
+    :param amount: The amount in sela, including the fee estimated with one input
+    :return: The selected utxos, None if they are not enough
+    """
+    _fee = 0
     while True:
-        time.sleep(30)
-        tx_details = request.get_tx(tx_id=txid_returned)
-        if tx_details["confirmations"] > 0:
-            _height = request.get_block_height()
-            util.feedback(
-                content=f"Tx[{txid_returned}] is confirmed at height[{_height}], the amount of distribution is {amountDistribution_str}.",
-                module="DPS")
+        selected = cache.select_utxos(utxos, amount + _fee)
+        if selected is None or cf.tx_fee_per_kb == 0:
+            return selected
+        _inputFee = -(-(len(selected) - 1) * t.TxInput.serialize_size() * cf.tx_fee_per_kb // 1000)
+        if _inputFee <= _fee:
+            return selected
+        _fee = _inputFee
+
+
+def splitReceivers(plan: dict, countInputs: int, producer: dict) -> list:
+    """
+    Split the receivers into shards, the transaction of each shard is not larger than 'tx_max_size'. The first shard
+    spends the given number of inputs, and each of the others spends the change of the previous shard.
+    :param plan: The distribution, see calculateDistribution
+    :param countInputs: The number of the inputs of the first shard
+    :param producer: The profile of the dpos node, see util.getProducers
+    :return: A list of the shards' outputs and the estimated sizes of their signed transactions
+    """
+    _attr = distributionMemo(plan, producer)
+    # The signature is 65 bytes
+    _program = t.Program(code=encoding.get_code_from_pb(producer["public_key"]), parameter="00" * 65)
+    _outputSize = t.TxOutput.serialize_size(t.TxVersionDefault)
+
+    def _size(countInputs: int, countOutputs: int):
+        # the size of the signed transaction with the receivers' outputs and a change output
+        _base = t.Transaction(inputs=[None] * countInputs, outputs=[], attributes=[_attr], programs=[_program])
+        return _base.serialize_size() - Serialize.serialize_variable_int_size(0) + \
+               Serialize.serialize_variable_int_size(countOutputs + 1) + (countOutputs + 1) * _outputSize
+
+    shards = []
+    _receivers = list(plan["receivers"].items())
+    while len(_receivers) > 0 or len(shards) == 0:
+        _countInputs = countInputs if len(shards) == 0 else 1
+        _count = min(len(_receivers), max(0, (cf.tx_max_size - _size(_countInputs, 0)) // _outputSize))
+        while _count > 0 and _size(_countInputs, _count) > cf.tx_max_size:
+            _count -= 1
+        if _count == 0 and len(_receivers) > 0:
+            raise ValueError(f"tx_max_size[{cf.tx_max_size}] is too small for a distribution transaction.")
+        _outputs = util.gen_output_by_receiver(dict(_receivers[:_count])) if _count > 0 else []
+        shards.append((_outputs, _size(_countInputs, _count)))
+        _receivers = _receivers[_count:]
+    return shards
+
+
+def shardFees(sizes: list) -> list:
+    """
+    Calculate the fee of each shard in proportion to its size. If 'tx_fee_per_kb' is 0, the shards share 'tx_fee'.
+    :param sizes: The sizes of the shards' transactions
+    :return: The fees in sela
+    """
+    if cf.tx_fee_per_kb > 0:
+        return [-(-_size * cf.tx_fee_per_kb // 1000) for _size in sizes]
+    _total = sum(sizes)
+    fees = [cf.tx_fee * _size // _total for _size in sizes]
+    fees[0] += cf.tx_fee - sum(fees)
+    return fees
+
+
+def estimateDistributionFee(plan: dict, producer: dict) -> int:
+    """
+    Estimate the fee of the distribution, supposing it spends one utxo.
+    """
+    return sum(shardFees([_size for _, _size in splitReceivers(plan, 1, producer)]))
+
+
+def distributionMemo(plan: dict, producer: dict):
+    # Create the memo attribute of the transactions
+    data_memo = f"{cf.Memo_Prefix}{producer['MsgForMemo']} {plan['message']}".encode()
+    return t.Attribute(usage=t.AttributeUsage_Memo, data=data_memo)
+
+
+def buildDistributionTxs(plan: dict, inputs: list, utxoAmount: int, producer: dict, inputValues: dict):
+    """
+    Create and sign the transactions of the distribution, the receivers are split into shards under 'tx_max_size'.
+    The shards are chained, each one spends the change of the previous one, and the last change is sent back to the
+    distribution address. The shards are signed and verified in parallel.
+    :param plan: The distribution, see calculateDistribution
+    :param inputs: The inputs of the first shard
+    :param utxoAmount: The amount of the inputs in sela
+    :param producer: The profile of the dpos node, see util.getProducers
+    :param inputValues: The value of each input keyed by the txid and the index, see getDistributionInputs. The change
+        of each shard is added to it, so the next distribution of a chain can spend it.
+    :return:
+        shards: A list of dicts, the raw transaction, the txid, the amount, the fee, the inputs and the change of
+            each shard
+        the index and the value of the change output of the last shard
+    """
+    _shards = splitReceivers(plan, len(inputs), producer)
+    _fees = shardFees([_size for _, _size in _shards])
+    util.feedback(content=f"The distribution is split into {len(_shards)} transactions, fee {sum(_fees)}",
+                  module="DPS")
+    shards = []
+    txs = []
+    for (outputs, _), _fee in zip(_shards, _fees):
+        _amount = sum(_output.value for _output in outputs)
+        # Create output
+        _changeValue = utxoAmount - _amount - _fee
+        if _changeValue < 0:
+            raise DistributionError(f"The inputs are not enough to pay to voters in {plan['message']}")
+        _changeOutput = t.TxOutput(address=producer["address"], value=_changeValue)
+        outputs.append(_changeOutput)
+
+        # Disrupt tx_outputs order
+        random.shuffle(outputs)
+
+        # Create the transaction, include memo, attributes
+        tx_distribution = t.Transaction(inputs=inputs, outputs=outputs, attributes=[distributionMemo(plan, producer)])
+        txid_infile = encoding.bytes_to_hexstring(data=tx_distribution.hash(), reverse=True)
+        util.feedback(content=f"Txid is [{txid_infile}] before signed.", module="DPS")
+        txs.append(tx_distribution)
+        # The next shard spends the change
+        _changeIndex = outputs.index(_changeOutput)
+        shards.append({"txid": txid_infile, "amount": _amount, "fee": _fee,
+                       "inputs": [(_input.txid, _input.index) for _input in inputs],
+                       "change": (_changeIndex, _changeValue)})
+        inputValues[(txid_infile, _changeIndex)] = _changeValue
+        inputs = [t.TxInput(txid=txid_infile, index=_changeIndex)]
+        utxoAmount = _changeValue
+
+    # Sign the transactions
+    _code = encoding.get_code_from_pb(producer["public_key"])
+
+    def _sign(tx_distribution, shard):
+        _parameter = t.ecdsa_sign(producer["private_key"], data=tx_distribution.serialize_unsigned()).hex()
+        tx_distribution.programs = [t.Program(code=_code, parameter=_parameter)]
+        # Serialize the transaction to get the raw data of the transaction
+        raw_tx = tx_distribution.serialize()
+        # Verify the transaction before it is recorded and sent
+        return raw_tx.hex(), verifyDistributionTx(tx_distribution, raw_tx, shard["fee"], inputValues, producer)
+
+    with ThreadPoolExecutor(max_workers=cf.sign_workers) as executor:
+        for _shard, (raw_tx, _error) in zip(shards, executor.map(_sign, txs, shards)):
+            if _error is not None:
+                raise DistributionError(f"Tx[{_shard['txid']}] is invalid: {_error}")
+            _shard["raw"] = raw_tx
+            util.write_tx_to_file(rawtx=raw_tx, txid=_shard["txid"])
+            util.feedback(content=f"RawTx:[{raw_tx}]", level=DEBUG, module="DPS")
+    return shards, _changeIndex, utxoAmount
+
+
+def verifyDistributionTx(tx_distribution, raw_tx: bytes, fee: int, inputValues: dict, producer: dict):
+    """
+    Check the signed transaction with the public key of the distribution address, and check that its inputs pay
+    exactly its outputs and the fee.
+    :param tx_distribution: The signed transaction
+    :param raw_tx: The serialized transaction
+    :param fee: The fee of the transaction in sela
+    :param inputValues: The known value of each input keyed by the txid and the index, the others are looked up on
+        the node, see getInputValue
+    :param producer: The profile of the dpos node, see util.getProducers
+    :return: The error, None if the transaction is valid
+    """
+    if not tx_distribution.verify_signature(producer["public_key"]):
+        return f"The signature doesn't match the public key[{producer['public_key']}]"
+    _inputAmount = 0
+    for _input in tx_distribution.inputs:
+        _value = getInputValue(_input.txid, _input.index, producer["address"], inputValues)
+        if _value is None:
+            return f"The input[{_input.txid}:{_input.index}] is not a utxo of [{producer['address']}]"
+        _inputAmount += _value
+    _outputAmount = sum(_output.value for _output in tx_distribution.outputs)
+    if _inputAmount != _outputAmount + fee:
+        return f"The inputs[{_inputAmount}] don't equal the outputs[{_outputAmount}] plus the fee[{fee}]"
+    if len(raw_tx) != tx_distribution.serialize_size():
+        return f"The size[{len(raw_tx)}] doesn't equal serialize_size[{tx_distribution.serialize_size()}]"
+    return None
+
+
+def getInputValue(txid: str, index: int, address: str, inputValues: dict):
+    """
+    Get the value of an input from the known values, or from the transaction on the node.
+    :param txid: The txid of the utxo
+    :param index: The index of the utxo
+    :param address: The address which the utxo must belong to
+    :param inputValues: The known values keyed by the txid and the index
+    :return: The value in sela, None if it can't be resolved
+    """
+    _value = inputValues.get((txid, index))
+    if _value is not None:
+        return _value
+    try:
+        _tx = request.get_tx(tx_id=txid)
+    except Exception as e:
+        util.feedback(content=f"Failed to get Tx[{txid}]: {e}", level=WARNING, module="DPS")
+        return None
+    if _tx is None:
+        return None
+    for _vout in _tx.get("vout", []):
+        if _vout.get("n") == index and _vout.get("address") == address:
+            return util.strElaToIntSela(_vout["value"])
+    return None
+
+
+# The txid in the record of a distribution without any reward
+EMPTY_TXID = "xxxxxxxxxxxxxxxxxxxx"
+
+
+def writeEmptyDistribution(plan: dict, producer: dict):
+    util.write_distribution_record(round=plan["round"], hei=plan["height"], amount="0", txid=EMPTY_TXID, fee=0,
+                                   producer=producer)
+
+
+def sendDistributionTxs(plan: dict, shards: list, producer: dict):
+    """
+    Write the distribution record and send the transactions to the node in order, see sendShards.
+    :param plan: The distribution, see calculateDistribution
+    :param shards: The transactions of the distribution, see buildDistributionTxs
+    :param producer: The profile of the dpos node, see util.getProducers
+    :return: None
+    """
+    # Update the distribution record before sending the transactions, the txids of the shards are joined by '|'
+    util.write_distribution_record(round=plan["round"], hei=plan["height"], amount=util.SelaToEla(plan["amount"]),
+                                   txid="|".join(_shard["txid"] for _shard in shards),
+                                   fee=sum(_shard["fee"] for _shard in shards), producer=producer)
+    sendShards(shards, producer)
+
+
+def sendShards(shards: list, producer: dict):
+    """
+    Send the transactions to the node in order. If one of them fails, DistributionError is raised. The distribution
+    record is kept, so the distribution is never built twice, and the rest are sent again from the files of the
+    transactions by resendLastDistribution.
+    :param shards: The transactions, see buildDistributionTxs
+    :param producer: The profile of the dpos node, see util.getProducers
+    :return: None
+    """
+    for _shard in shards:
+        txid_infile = _shard["txid"]
+        try:
+            txid_returned = request.send_tx(raw_tx=_shard["raw"])
+            if txid_returned != txid_infile and request.get_tx(tx_id=txid_infile) is not None:
+                # It has been accepted by the node before
+                txid_returned = txid_infile
+        except Exception as e:
+            txid_returned = repr(e)
+
+        if txid_returned != txid_infile:
+            raise DistributionError(f"Send TX ERROR!txid:[{txid_infile}], return:[{txid_returned}]")
+        else:
             time_str = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time()))
-            util.feedback(content=f"[{time_str}]Distribution finished, bye", module="DPS")
-            break
+            _height = request.get_block_height()
+            util.feedback(content=f"[{time_str}]Tx[{txid_returned}] is send to node, height[{_height}].",
+                          module="DPS")
+            if cf.utxo_tracker:
+                cache.get_utxo_set().spend(producer["address"], txid_infile, _shard["inputs"],
+                                           [] if _shard["change"] is None else [_shard["change"]])
 
 
-if __name__ == '__main__':
-    currehtHeight = request.get_block_height()
+# The txids in the last distribution record which are all known by the node, keyed by the name of the dpos node
+_checkedRecords = {}
+
+
+def resendLastDistribution(producer: dict) -> bool:
+    """
+    Look up the transactions of the last distribution record on the node, and send the ones which the node doesn't
+    know again from the files of the transactions. The record is written before the transactions are sent, so they
+    are left here if the sending failed or the program exited.
+    :param producer: The profile of the dpos node, see util.getProducers
+    :return: True if any transaction is sent again
+    """
+    _txids = util.get_last_distribution_record(producer)[3]
+    if _txids in ("", EMPTY_TXID) or _checkedRecords.get(producer["name"]) == _txids:
+        return False
+    shards = []
+    for _txid in _txids.split("|"):
+        if request.get_tx(tx_id=_txid) is not None:
+            continue
+        _raw = util.read_tx_from_file(_txid)
+        if _raw is None:
+            raise DistributionError(f"Tx[{_txid}] of the last distribution is neither known by the node nor recorded "
+                                    f"in {cf.tx_path}")
+        shards.append(shardFromRawTx(_raw, _txid, producer))
+    if len(shards) > 0:
+        util.feedback(content=f"Send the {len(shards)} transactions of the last distribution which are not known by "
+                              f"the node again", level=WARNING, module="DPS")
+        sendShards(shards, producer)
+        waitForConfirmations(shards)
+    _checkedRecords[producer["name"]] = _txids
+    return len(shards) > 0
+
+
+def shardFromRawTx(raw_tx: str, txid: str, producer: dict) -> dict:
+    """
+    Rebuild a shard from a recorded transaction, see buildDistributionTxs
+    """
+    _tx, _ = t.Transaction.unserialize(bytes.fromhex(raw_tx))
+    _txid = encoding.bytes_to_hexstring(data=_tx.hash(), reverse=True)
+    if _txid != txid:
+        raise DistributionError(f"The recorded Tx[{txid}] is corrupted, its hash is [{_txid}]")
+    _change = [(i, _output.value) for i, _output in enumerate(_tx.outputs) if _output.address() == producer["address"]]
+    _amount = sum(_output.value for _output in _tx.outputs) - sum(_value for _, _value in _change)
+    return {"txid": txid, "raw": raw_tx, "amount": _amount,
+            "inputs": [(_input.txid, _input.index) for _input in _tx.inputs],
+            "change": _change[0] if len(_change) > 0 else None}
+
+
+def hasPendingDistribution(producer: dict) -> bool:
+    """
+    :param producer: The profile of the dpos node, see util.getProducers
+    :return: True if a distribution cycle has ended but isn't distributed, or the transactions of the last
+        distribution are not checked on the node yet
+    """
+    _txids = util.get_last_distribution_record(producer)[3]
+    if _txids not in ("", EMPTY_TXID) and _checkedRecords.get(producer["name"]) != _txids:
+        # the transactions of the last distribution are not checked yet, see resendLastDistribution
+        return True
+    lastDposRound = util.get_last_dpos_record(producer)[0]
+    lastDistributionRound = util.get_last_distribution_record(producer)[0]
+    return lastDposRound / cf.distribute_round - lastDistributionRound >= 1
+
+
+def consolidateUtxos(producer: dict) -> bool:
+    """
+    Sweep the dust utxos of the distribution address into one utxo, when there are at least 'utxo_consolidate_count'
+    of them. The transaction is not larger than 'tx_max_size', and it isn't waited for.
+    :param producer: The profile of the dpos node, see util.getProducers
+    :return: True if a transaction is sent
+    """
+    _address = producer["address"]
+    _utxos = syncUtxos(_address)
+    if _utxos is None:
+        return False
+    _dust = sorted([_utxo for _utxo in _utxos if _utxo[2] < cf.utxo_dust_value], key=lambda _utxo: _utxo[2])
+    if len(_dust) < max(2, cf.utxo_consolidate_count):
+        return False
+
+    _code = encoding.get_code_from_pb(producer["public_key"])
+    _output = t.TxOutput(address=_address, value=0)
+    # The signature is 65 bytes
+    _base = t.Transaction(inputs=[], outputs=[_output], programs=[t.Program(code=_code, parameter="00" * 65)])
+    _baseSize = _base.serialize_size() - Serialize.serialize_variable_int_size(0)
+    _count = len(_dust)
+    while _count > 1 and _baseSize + Serialize.serialize_variable_int_size(_count) + \
+            _count * t.TxInput.serialize_size() > cf.tx_max_size:
+        _count -= 1
+    _dust = _dust[:_count]
+    _size = _baseSize + Serialize.serialize_variable_int_size(_count) + _count * t.TxInput.serialize_size()
+    _fee = shardFees([_size])[0]
+    _inputAmount = sum(_value for _, _, _value in _dust)
+    _output.value = _inputAmount - _fee
+    if _output.value <= 0:
+        return False
+
+    tx_consolidation = t.Transaction(inputs=[t.TxInput(txid=_txid, index=_vout) for _txid, _vout, _ in _dust],
+                                     outputs=[_output])
+    txid = encoding.bytes_to_hexstring(data=tx_consolidation.hash(), reverse=True)
+    _parameter = t.ecdsa_sign(producer["private_key"], data=tx_consolidation.serialize_unsigned()).hex()
+    tx_consolidation.programs = [t.Program(code=_code, parameter=_parameter)]
+    raw_tx = tx_consolidation.serialize()
+    _error = verifyDistributionTx(tx_consolidation, raw_tx, _fee,
+                                  {(_txid, _vout): _value for _txid, _vout, _value in _dust}, producer)
+    if _error is not None:
+        util.feedback(content=f"Tx[{txid}] is invalid: {_error}", level=ERROR, module="DPS")
+        return False
+
+    util.feedback(content=f"Sweep {_count} dust utxos of [{_address}], {util.SelaToEla(_inputAmount)} in total",
+                  module="DPS")
+    txid_returned = request.send_tx(raw_tx=raw_tx.hex())
+    if txid_returned != txid:
+        util.feedback(content=f"Send TX ERROR!txid:[{txid}], return:[{txid_returned}]", level=WARNING, module="DPS")
+        return False
+    cache.get_utxo_set().spend(_address, txid, [(_txid, _vout) for _txid, _vout, _ in _dust], [(0, _output.value)])
+    util.feedback(content=f"Tx[{txid}] is send to node.", module="DPS")
+    return True
+
+
+def waitForConfirmations(shards: list):
+    """
+    Wait until all the transactions are packaged by the node.
+    :param shards: The transactions, see buildDistributionTxs
+    :return: None
+    """
+    util.feedback(content="Wait for wallet be confirmed.", module="DPS")
+    _pending = list(shards)
+    while len(_pending) > 0:
+        time.sleep(30)
+        _height = None
+        for _shard in list(_pending):
+            tx_details = request.get_tx(tx_id=_shard["txid"])
+            if tx_details["confirmations"] > 0:
+                _height = request.get_block_height() if _height is None else _height
+                util.feedback(
+                    content=f"Tx[{_shard['txid']}] is confirmed at height[{_height}], the amount of distribution is "
+                            f"{util.SelaToEla(_shard['amount'])}.",
+                    module="DPS")
+                _pending.remove(_shard)
     time_str = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time()))
-    util.feedback(content=f"[{time_str}]current height:{currehtHeight}", module="DPS")
+    util.feedback(content=f"[{time_str}]Distribution finished, bye", module="DPS")
+
+
+def distributePendingCycle(producer=None, catchUp=False) -> bool:
+    """
+    Distribute the next cycle of the dpos reward if it has ended. The transactions of the last distribution which are
+    not known by the node are sent again first, see resendLastDistribution.
+    :param producer: The profile of the dpos node, see util.getProducers
+    :param catchUp: distribute all the pending cycles at once, see distributeCycles
+    :return: True if any cycle is distributed
+    """
+    producer = util.getProducer(producer)
+    if resendLastDistribution(producer):
+        return True
 
-    # update the record of the node dpos reward
-    util.update_dpos_record(currehtHeight)
-    lastDposRound, lastDposHeight, lastVoteHeight = util.get_last_dpos_record()
+    lastDposRound, lastDposHeight, lastVoteHeight = util.get_last_dpos_record(producer)
 
     # get the last distribution record
-    lastRecord = util.get_last_distribution_record()
+    lastRecord = util.get_last_distribution_record(producer)
     lastDistributionRound = lastRecord[0]
     lastDistributionHeight = lastRecord[1]
     lastDistributionAmount = lastRecord[2]
@@ -226,8 +711,111 @@ if __name__ == '__main__':
     if remainRound < 1:
         util.feedback(content="This distribution cycle has not ended, the distributer program will start later",
                       module="DPS")
-        exit()
+        return False
     else:
         util.feedback(content=f"The number of rounds need to be distributed is {int(remainRound)}", module="DPS")
         util.feedback(content=f"Now to distribute the next round begin after {lastDistributionHeight}", module="DPS")
-        distributeReward(lastDistributionRound, lastDistributionHeight)
+        if catchUp:
+            distributeCycles(lastDistributionRound, lastDistributionHeight, int(remainRound), producer)
+        else:
+            distributeReward(lastDistributionRound, lastDistributionHeight, producer)
+        return True
+
+
+def distributeAllProducers(producers: list, catchUp=False):
+    """
+    Distribute the pending cycle of each dpos node, the nodes are distributed in parallel and share the caches. The
+    nodes which share a distribution address are distributed one by one, so they never spend the same utxos.
+    The failure of a node doesn't stop the others, the errors are reported after all nodes are done.
+    :param producers: The profiles of the dpos nodes, see util.getProducers
+    :param catchUp: distribute all the pending cycles at once instead of the next one, see distributeCycles
+    :return: None
+    """
+    def _distribute(group):
+        errors = []
+        for _producer in group:
+            try:
+                distributePendingCycle(_producer, catchUp=catchUp)
+            except Exception as e:
+                util.feedback(content=f"The distribution of the dpos node[{_producer['name']}] failed: {e!r}",
+                              level=ERROR, module="DPS")
+                errors.append(_producer["name"])
+        return errors
+
+    _groups = {}
+    for _producer in producers:
+        _groups.setdefault(_producer["address"], []).append(_producer)
+    if len(_groups) == 1:
+        _failed = _distribute(producers)
+    else:
+        with ThreadPoolExecutor(max_workers=len(_groups)) as executor:
+            _failed = [_name for _errors in executor.map(_distribute, _groups.values()) for _name in _errors]
+    if len(_failed) > 0:
+        raise DistributionError(f"The distribution of the dpos nodes {_failed} failed")
+
+
+def follow():
+    """
+    Keep running and poll the best block of the node. The polling interval is doubled from 'follow_poll_min' up to
+    'follow_poll_max' while there is no new block, and reset when a new block arrives. The dpos record is updated at
+    each new block and the reward is distributed as soon as a cycle ends. If 'utxo_consolidate' is set, the dust utxos
+    of the nodes which have no pending distribution are swept after the distributions. A failed block is logged and
+    retried at the next block.
+    :return: None
+    """
+    util.feedback(content="Follow the best block of the node.", module="DPS")
+    producers = util.getProducers()
+    # the scanner states keyed by the name of the dpos node
+    scanStates = None
+    lastHeight = 0
+    interval = cf.follow_poll_min
+    while True:
+        try:
+            currentHeight = request.get_block_height()
+        except Exception as e:
+            util.feedback(content=f"Failed to get the current height: {e}", level=WARNING, module="DPS")
+            currentHeight = None
+        if currentHeight is None or currentHeight <= lastHeight:
+            interval = min(interval * 2, cf.follow_poll_max)
+        else:
+            lastHeight = currentHeight
+            interval = cf.follow_poll_min
+            time_str = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time()))
+            util.feedback(content=f"[{time_str}]current height:{currentHeight}", level=DEBUG, module="DPS")
+            try:
+                scanStates = util.update_dpos_records(currentHeight, states=scanStates, producers=producers)
+                distributeAllProducers(producers, catchUp=True)
+                if cf.utxo_consolidate and cf.utxo_tracker:
+                    for _producer in producers:
+                        if not hasPendingDistribution(_producer):
+                            consolidateUtxos(_producer)
+            except Exception as e:
+                # the scanner states are reloaded from the records at the next block
+                scanStates = None
+                util.feedback(content=f"Failed at height[{currentHeight}], retry at the next block: {e!r}",
+                              level=ERROR, module="DPS")
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Distribute the dpos reward to the voters.")
+    parser.add_argument("--follow", action="store_true",
+                        help="keep running and distribute the reward as soon as a cycle ends")
+    parser.add_argument("--catch-up", action="store_true",
+                        help="distribute all the pending cycles at once with a chain of transactions")
+    args = parser.parse_args()
+
+    if args.follow:
+        follow()
+    else:
+        currehtHeight = request.get_block_height()
+        time_str = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time()))
+        util.feedback(content=f"[{time_str}]current height:{currehtHeight}", module="DPS")
+
+        # update the record of the dpos reward of all nodes
+        producers = util.getProducers()
+        util.update_dpos_records(currehtHeight, producers=producers)
+        try:
+            distributeAllProducers(producers, catchUp=args.catch_up)
+        except DistributionError:
+            exit(2)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+@author: Bocheng.Zhang
+@license: MIT
+@contact: bocheng0000@gmail.com
+@file: simulator.py
+@time: 2019-08-05 10:30
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import sqlite3
+
+import config as cf
+from utility import util, cache, reward
+
+# The vote cache opened for reading only in each worker process
+_voteCache = None
+
+
+def applySettings(settings: dict):
+    """
+    Override the distribution rule in config, it is called in each worker process before the simulation.
+    :param settings: A dict, key: the name of the parameter in config, value: the new value
+    :return: None
+    """
+    global _voteCache
+    for _key, _value in settings.items():
+        setattr(cf, _key, _value)
+    if "investorEquity" in settings.keys():
+        for _investor in cf.investors.values():
+            _investor["Votes"] = cf.investorEquity
+    cf.investorsVotes = cf.investorEquity * cf.investorCount
+    _voteCache = cache.VoteCache(cf.cache_file, readonly=True)
+
+
+def getCachedVotesByHeight(ownerPb: str, hei: int):
+    """
+    get the voters and the total votes at the specified height from the vote cache only
+    :param ownerPb: the owner public key of the dpos node
+    :param hei: the vote height
+    :return: the voters and the total votes, see util.getVotersByHeight and util.getTotalVotesByHeight. Both are None
+        if the votes at this height are not cached.
+    """
+    _snapshot = _voteCache.get_voters(ownerPb, hei)
+    _rank = _voteCache.get_rank(hei)
+    if _snapshot is None or _rank is None:
+        return None, None
+    _totalVotes = util.indexRank(_rank).get(ownerPb)
+    if _totalVotes is None:
+        return None, None
+    return util.mergeInvestors(_snapshot), _totalVotes
+
+
+def simulateCycle(cycle: int, dposRecord: dict, ownerPb: str, payouts: bool) -> dict:
+    """
+    Calculate the distribution of a cycle in the same way as distributer.distributeReward, without any transaction.
+    :param cycle: The index of the distribution cycle, starting from 1
+    :param dposRecord: The dpos records of the rounds in this cycle, see util.getDposRecord
+    :param ownerPb: The owner public key of the dpos node
+    :param payouts: Return the reward of each address
+    :return: A dict
+        cycle, firstRound, lastRound, firstHeight, lastHeight: the rounds and the dpos heights of this cycle
+        reward: the dpos reward of the node in sela
+        distribution: the amount distributed to the voters in sela
+        receivers: the number of the addresses which receive the reward
+        missing: the vote heights which are not in the vote cache, the cycle isn't calculated if any
+        payouts: key: the voter's address, value: the reward in sela
+    """
+    _rounds = sorted(dposRecord.keys())
+    result = {"cycle": cycle, "firstRound": _rounds[0], "lastRound": _rounds[-1],
+              "firstHeight": dposRecord[_rounds[0]]["dposHeight"], "lastHeight": dposRecord[_rounds[-1]]["dposHeight"],
+              "reward": 0, "distribution": 0, "receivers": 0, "missing": []}
+    rewardInRound = reward.RewardMatrix()
+    for i in _rounds:
+        _amount = dposRecord[i]["reward"]
+        result["reward"] += _amount
+        if _amount == 0:
+            continue
+        _voteHeight = dposRecord[i]["voteHeight"]
+        _voters, _totalVotes = getCachedVotesByHeight(ownerPb, _voteHeight)
+        if _voters is None:
+            result["missing"].append(_voteHeight)
+            continue
+        rewardInRound.add_round(i, reward.amount_to_distribute(_amount), _voters, totalVotes=_totalVotes)
+    if len(result["missing"]) > 0:
+        return result
+
+    receivers, _ = rewardInRound.calculate()
+    # The addresses which have no voting reward are removed, the same as the distribution
+    _payouts = {_add: int(_value) for _add, _value in receivers.items() if int(_value) != 0}
+    result["distribution"] = sum(_payouts.values())
+    result["receivers"] = len(_payouts)
+    if payouts:
+        result["payouts"] = _payouts
+    return result
+
+
+def simulate(producer: dict, settings: dict, firstCycle=1, lastCycle=None, workers=None, payouts=False):
+    """
+    Replay the distribution cycles with the dpos records and the vote snapshots cached locally. Nothing is sent to
+    the node or the api server, and no file is written.
+    :param producer: The profile of the dpos node, see util.getProducers
+    :param settings: The distribution rule to simulate, see applySettings
+    :param firstCycle: The first cycle to replay, starting from 1
+    :param lastCycle: The last cycle to replay, the last complete cycle in the dpos records if it is None. ValueError
+        is raised if it is beyond the last complete cycle.
+    :param workers: The number of the worker processes, the number of CPUs if it is None
+    :param payouts: Return the reward of each address too
+    :return: A generator of the results of the cycles in order, see simulateCycle
+    """
+    distributeRound = settings.get("distribute_round", cf.distribute_round)
+    _lastComplete = util.get_last_dpos_record(producer)[0] // distributeRound
+    if lastCycle is None:
+        lastCycle = _lastComplete
+    elif lastCycle > _lastComplete:
+        raise ValueError(f"The cycle {lastCycle} is beyond the dpos records, the last complete cycle is "
+                         f"{_lastComplete}")
+    if lastCycle < firstCycle:
+        return
+    dposRecord = util.getDposRecord((firstCycle - 1) * distributeRound + 1, lastCycle * distributeRound, producer)
+
+    _cycles = range(firstCycle, lastCycle + 1)
+    _records = [{i: dposRecord[i] for i in range((_cycle - 1) * distributeRound + 1, _cycle * distributeRound + 1)}
+                for _cycle in _cycles]
+    with ProcessPoolExecutor(max_workers=workers, initializer=applySettings, initargs=(settings,)) as executor:
+        yield from executor.map(simulateCycle, _cycles, _records, [producer["ownerPublicKey"]] * len(_cycles),
+                                [payouts] * len(_cycles), chunksize=max(1, len(_cycles) // (4 * (workers or 8))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate the distribution of the historical cycles offline. Each "
+                                                 "cycle is printed as a line of json.")
+    parser.add_argument("--producer", help="the name of the dpos node in 'producers', the first node by default")
+    parser.add_argument("--first-cycle", type=int, default=1, help="the first cycle to replay, starting from 1")
+    parser.add_argument("--last-cycle", type=int, help="the last cycle to replay, the last complete cycle by default")
+    parser.add_argument("--distribute-round", type=int, help="override 'distribute_round'")
+    parser.add_argument("--distribution-percent", type=float, help="override 'distribution_percent'")
+    parser.add_argument("--operating-costs", type=int, help="override 'operating_costs', in sela")
+    parser.add_argument("--investor-equity", type=int, help="override 'investorEquity', in sela")
+    parser.add_argument("--investor-count", type=int, help="override 'investorCount'")
+    parser.add_argument("--integer-mode", action="store_true", help="allocate the reward in sela exactly")
+    parser.add_argument("--payouts", action="store_true", help="print the reward of each address")
+    parser.add_argument("--workers", type=int, help="the number of worker processes, the number of CPUs by default")
+    args = parser.parse_args()
+
+    _producers = util.getProducers()
+    if args.producer is not None:
+        _producers = [_p for _p in _producers if _p["name"] == args.producer]
+        if len(_producers) == 0:
+            parser.error(f"There is no dpos node named {args.producer}")
+    if not os.path.exists(cf.cache_file) or not os.path.exists(_producers[0]["dpos_record_file"]):
+        parser.error("The dpos records and the vote cache are required, please run distributer.py first")
+
+    _settings = {"distribute_round": args.distribute_round, "distribution_percent": args.distribution_percent,
+                 "operating_costs": args.operating_costs, "investorEquity": args.investor_equity,
+                 "investorCount": args.investor_count, "reward_integer_mode": args.integer_mode or None}
+    _settings = {_key: _value for _key, _value in _settings.items() if _value is not None}
+    try:
+        for _result in simulate(_producers[0], _settings, firstCycle=args.first_cycle, lastCycle=args.last_cycle,
+                                workers=args.workers, payouts=args.payouts):
+            print(json.dumps(_result, sort_keys=True))
+    except sqlite3.Error as e:
+        parser.error(f"Failed to read the vote cache: {e}")
+    except ValueError as e:
+        parser.error(str(e))
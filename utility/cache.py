@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+@author: Bocheng.Zhang
+@license: MIT
+@contact: bocheng0000@gmail.com
+@file: cache.py
+@time: 2019-07-20 10:12
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import sqlite3
+import threading
+
+import config as cf
+
+
+class SqliteCache:
+    """
+    The base of the local caches, a sqlite connection shared by all threads.
+    """
+    tables = []
+
+    columns = {}
+
+    def __init__(self, path: str, readonly=False):
+        self._lock = threading.Lock()
+        if readonly:
+            # open the existing cache for reading only, nothing is created or migrated
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            return
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            for _table in self.tables:
+                self._conn.execute(f"CREATE TABLE IF NOT EXISTS {_table}")
+            # add the columns which are missing in the cache created by the previous version
+            for _table, _columns in self.columns.items():
+                _existing = [_row[1] for _row in self._conn.execute(f"PRAGMA table_info({_table})")]
+                for _column in _columns:
+                    if _column.split()[0] not in _existing:
+                        self._conn.execute(f"ALTER TABLE {_table} ADD COLUMN {_column}")
+            self._conn.commit()
+
+    def _fetchone(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def _execute(self, *statements):
+        """
+        Execute the statements in one transaction.
+        :param statements: A list of (sql, params)
+        :return: None
+        """
+        with self._lock:
+            for _sql, _params in statements:
+                self._conn.execute(_sql, _params)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class BlockCache(SqliteCache):
+    """
+    The local cache of the blocks' coinbase outputs and timestamps, keyed by height.
+    Only the blocks below the confirmation depth are stored, so the data in the cache never changes.
+    """
+    tables = ["block (height INTEGER PRIMARY KEY, time INTEGER NOT NULL, vout TEXT NOT NULL)"]
+
+    def get_block(self, height: int):
+        """
+        get the cached block at the specified height
+        :param height: the specified height
+        :return: A dict with the timestamp and the coinbase's outputs of the block, None if it is not cached.
+        """
+        _row = self._fetchone("SELECT time, vout FROM block WHERE height = ?", (height,))
+        if _row is None:
+            return None
+        return {"time": _row[0], "vout": json.loads(_row[1])}
+
+    def put_block(self, height: int, time: int, vout: list):
+        """
+        store the block at the specified height
+        :param height: the specified height
+        :param time: the timestamp of the block
+        :param vout: the coinbase's outputs of the block
+        :return: None
+        """
+        self._execute(("INSERT OR REPLACE INTO block (height, time, vout) VALUES (?, ?, ?)",
+                       (height, time, json.dumps(vout, separators=(",", ":")))))
+
+
+class VoteCache(SqliteCache):
+    """
+    The local cache of the votes at the historical heights, which never change.
+    The snapshots are stored by the digest of their content, so the identical snapshots of different heights are
+    stored once. A voter snapshot is stored as the delta from the snapshot of the previous cached height, with a full
+    snapshot at least every 'voter_delta_depth' deltas.
+    """
+    tables = ["snapshot (digest TEXT PRIMARY KEY, data TEXT NOT NULL)",
+              "voter_snapshot (owner TEXT NOT NULL, height INTEGER NOT NULL, digest TEXT NOT NULL, "
+              "PRIMARY KEY (owner, height))",
+              "rank_snapshot (height INTEGER PRIMARY KEY, digest TEXT NOT NULL)"]
+    # base: the digest of the snapshot which the delta is based on, NULL for a full snapshot
+    # depth: the number of deltas from the full snapshot
+    columns = {"snapshot": ["base TEXT", "depth INTEGER NOT NULL DEFAULT 0"]}
+
+    def __init__(self, path: str, readonly=False):
+        super().__init__(path, readonly)
+        # the snapshots rebuilt recently, keyed by digest
+        self._rebuilt = OrderedDict()
+
+    def get_voters(self, owner: str, height: int):
+        """
+        get the cached voters of the owner at the specified height
+        :return: A dict keyed by the voter's address, None if it is not cached. The dict is shared, don't modify it.
+        """
+        _row = self._fetchone("SELECT digest FROM voter_snapshot WHERE owner = ? AND height = ?", (owner, height))
+        return None if _row is None else self._rebuild(_row[0])
+
+    def put_voters(self, owner: str, height: int, voters: dict):
+        _data = json.dumps(voters, sort_keys=True, separators=(",", ":"))
+        _digest = hashlib.sha256(_data.encode()).hexdigest()
+        _base = None
+        _depth = 0
+        if self._fetchone("SELECT 1 FROM snapshot WHERE digest = ?", (_digest,)) is None:
+            _row = self._fetchone(
+                "SELECT s.digest, s.depth FROM voter_snapshot v JOIN snapshot s ON v.digest = s.digest "
+                "WHERE v.owner = ? AND v.height < ? ORDER BY v.height DESC LIMIT 1", (owner, height))
+            if _row is not None and _row[1] < cf.voter_delta_depth:
+                _delta = json.dumps(diff_voters(self._rebuild(_row[0]), voters), sort_keys=True,
+                                    separators=(",", ":"))
+                if len(_delta) < len(_data):
+                    _data, _base, _depth = _delta, _row[0], _row[1] + 1
+        self._execute(("INSERT OR IGNORE INTO snapshot (digest, data, base, depth) VALUES (?, ?, ?, ?)",
+                       (_digest, _data, _base, _depth)),
+                      ("INSERT OR REPLACE INTO voter_snapshot (owner, height, digest) VALUES (?, ?, ?)",
+                       (owner, height, _digest)))
+
+    def _rebuild(self, digest: str) -> dict:
+        """
+        Rebuild the voter snapshot from the full snapshot and the deltas after it.
+        :param digest: The digest of the voter snapshot
+        :return: The voter snapshot
+        """
+        _chain = []
+        _digest = digest
+        snapshot = None
+        while _digest is not None:
+            with self._lock:
+                snapshot = self._rebuilt.get(_digest)
+            if snapshot is not None:
+                break
+            _data, _base = self._fetchone("SELECT data, base FROM snapshot WHERE digest = ?", (_digest,))
+            _chain.append((_digest, json.loads(_data)))
+            _digest = _base
+        for _digest, _data in reversed(_chain):
+            snapshot = _data if snapshot is None else apply_voter_delta(snapshot, _data)
+            with self._lock:
+                self._rebuilt[_digest] = snapshot
+                self._rebuilt.move_to_end(_digest)
+                while len(self._rebuilt) > 8:
+                    self._rebuilt.popitem(last=False)
+        return snapshot
+
+    def get_rank(self, height: int):
+        """
+        get the cached producer rank at the specified height
+        :return: A list of the producers' owner public keys and votes, None if it is not cached.
+        """
+        return self._get_snapshot("SELECT digest FROM rank_snapshot WHERE height = ?", (height,))
+
+    def put_rank(self, height: int, rank: list):
+        self._put_snapshot(rank, "INSERT OR REPLACE INTO rank_snapshot (height, digest) VALUES (?, ?)", (height,))
+
+    def _get_snapshot(self, sql: str, params: tuple):
+        _row = self._fetchone(sql, params)
+        if _row is None:
+            return None
+        _row = self._fetchone("SELECT data FROM snapshot WHERE digest = ?", (_row[0],))
+        return None if _row is None else json.loads(_row[0])
+
+    def _put_snapshot(self, content, sql: str, params: tuple):
+        _data = json.dumps(content, sort_keys=True, separators=(",", ":"))
+        _digest = hashlib.sha256(_data.encode()).hexdigest()
+        self._execute(("INSERT OR IGNORE INTO snapshot (digest, data) VALUES (?, ?)", (_digest, _data)),
+                      (sql, params + (_digest,)))
+
+
+class UtxoSet(SqliteCache):
+    """
+    The utxos of the distribution addresses. It is synchronized with the node, and updated by the transactions sent
+    by this program, so the change of a transaction can be spent before it is confirmed.
+    """
+    # confirmed: 1 if the node has listed the utxo, 0 for the change of a transaction sent by this program
+    # spent_by: the txid of the transaction sent by this program which spends the utxo, NULL if it is unspent
+    tables = ["utxo (address TEXT NOT NULL, txid TEXT NOT NULL, vout INTEGER NOT NULL, value INTEGER NOT NULL, "
+              "confirmed INTEGER NOT NULL, spent_by TEXT, PRIMARY KEY (address, txid, vout))"]
+
+    def sync(self, address: str, utxos: list):
+        """
+        Synchronize with the utxos listed by the node. The utxos which are not listed any more are removed, except
+        the change of the transactions which are not confirmed yet.
+        :param address: The address of the utxos
+        :param utxos: A list of the txid, the index and the value in sela of each utxo
+        :return: None
+        """
+        _listed = {(_txid, _vout): _value for _txid, _vout, _value in utxos}
+        with self._lock:
+            _rows = self._conn.execute("SELECT txid, vout, confirmed, spent_by FROM utxo WHERE address = ?",
+                                       (address,)).fetchall()
+        _known = set()
+        statements = []
+        for _txid, _vout, _confirmed, _spentBy in _rows:
+            _known.add((_txid, _vout))
+            if (_txid, _vout) in _listed:
+                if not _confirmed:
+                    statements.append(("UPDATE utxo SET confirmed = 1 WHERE address = ? AND txid = ? AND vout = ?",
+                                       (address, _txid, _vout)))
+            elif _confirmed or _spentBy is not None:
+                # It is spent and the spending transaction is confirmed
+                statements.append(("DELETE FROM utxo WHERE address = ? AND txid = ? AND vout = ?",
+                                   (address, _txid, _vout)))
+        for (_txid, _vout), _value in _listed.items():
+            if (_txid, _vout) not in _known:
+                statements.append(("INSERT INTO utxo (address, txid, vout, value, confirmed) VALUES (?, ?, ?, ?, 1)",
+                                   (address, _txid, _vout, _value)))
+        self._execute(*statements)
+
+    def unspent(self, address: str) -> list:
+        """
+        :return: A list of the txid, the index and the value in sela of the utxos which are not spent by this program
+        """
+        with self._lock:
+            return self._conn.execute("SELECT txid, vout, value FROM utxo WHERE address = ? AND spent_by IS NULL",
+                                      (address,)).fetchall()
+
+    def spend(self, address: str, txid: str, inputs: list, outputs: list):
+        """
+        Record the transaction sent by this program.
+        :param address: The address of the utxos
+        :param txid: The hash of the transaction
+        :param inputs: The txid and the index of each input
+        :param outputs: The index and the value in sela of each output to the address
+        :return: None
+        """
+        statements = [("UPDATE utxo SET spent_by = ? WHERE address = ? AND txid = ? AND vout = ?",
+                       (txid, address, _txid, _vout)) for _txid, _vout in inputs]
+        statements += [("INSERT OR IGNORE INTO utxo (address, txid, vout, value, confirmed) VALUES (?, ?, ?, ?, 0)",
+                        (address, txid, _vout, _value)) for _vout, _value in outputs]
+        self._execute(*statements)
+
+    def pending(self, address: str) -> set:
+        """
+        :return: The txids of the transactions sent by this program which are not confirmed yet, they spend the utxos
+            still listed by the node, or their change isn't listed yet
+        """
+        with self._lock:
+            _rows = self._conn.execute("SELECT spent_by FROM utxo WHERE address = ? AND spent_by IS NOT NULL UNION "
+                                       "SELECT txid FROM utxo WHERE address = ? AND confirmed = 0",
+                                       (address, address)).fetchall()
+        return {_txid for _txid, in _rows}
+
+    def release(self, address: str, txid: str):
+        """
+        Forget a transaction sent by this program which is dropped by the node, its inputs are unspent again and its
+        change is removed.
+        :param address: The address of the utxos
+        :param txid: The hash of the dropped transaction
+        :return: None
+        """
+        self._execute(("UPDATE utxo SET spent_by = NULL WHERE address = ? AND spent_by = ?", (address, txid)),
+                      ("DELETE FROM utxo WHERE address = ? AND txid = ? AND confirmed = 0", (address, txid)))
+
+
+def select_utxos(utxos: list, amount: int) -> list:
+    """
+    Select the fewest utxos to pay the amount. The largest utxos are selected first, then the last one is replaced
+    by the smallest utxo which is still enough, to keep the large utxos and the change small.
+    :param utxos: A list of the txid, the index and the value in sela of each utxo
+    :param amount: The amount to pay in sela
+    :return: The selected utxos, None if they are not enough
+    """
+    _sorted = sorted(utxos, key=lambda _utxo: _utxo[2], reverse=True)
+    selected = []
+    _total = 0
+    for _utxo in _sorted:
+        if _total >= amount:
+            break
+        selected.append(_utxo)
+        _total += _utxo[2]
+    if _total < amount:
+        return None
+    if len(selected) > 0:
+        _rest = amount - (_total - selected[-1][2])
+        # the utxos after the selected ones are smaller, pick the smallest one which covers the rest
+        for _utxo in reversed(_sorted[len(selected) - 1:]):
+            if _utxo[2] >= _rest:
+                selected[-1] = _utxo
+                break
+    return selected
+
+
+def diff_voters(old: dict, new: dict) -> dict:
+    """
+    Compute the delta between two voter snapshots.
+    :param old: The voter snapshot of the previous height
+    :param new: The voter snapshot of the current height
+    :return: A dict
+        set: the voters which are added or whose votes are changed
+        remove: the addresses of the voters which are removed
+    """
+    return {"set": {_add: _voter for _add, _voter in new.items() if old.get(_add) != _voter},
+            "remove": [_add for _add in old.keys() if _add not in new]}
+
+
+def apply_voter_delta(old: dict, delta: dict) -> dict:
+    """
+    Apply the delta computed by diff_voters to the voter snapshot.
+    :param old: The voter snapshot of the previous height, it isn't modified
+    :param delta: The delta to the current height
+    :return: The voter snapshot of the current height
+    """
+    _removed = set(delta["remove"])
+    new = {_add: _voter for _add, _voter in old.items() if _add not in _removed}
+    new.update(delta["set"])
+    return new
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(cache_class):
+    """
+    return the cache shared by the whole program, it is opened at the first call.
+    :param cache_class: BlockCache, VoteCache or UtxoSet
+    """
+    _cache = _caches.get(cache_class)
+    if _cache is None:
+        with _caches_lock:
+            _cache = _caches.get(cache_class)
+            if _cache is None:
+                _cache = cache_class(cf.cache_file)
+                _caches[cache_class] = _cache
+    return _cache
+
+
+def get_block_cache() -> BlockCache:
+    return get_cache(BlockCache)
+
+
+def get_vote_cache() -> VoteCache:
+    return get_cache(VoteCache)
+
+
+def get_utxo_set() -> UtxoSet:
+    return get_cache(UtxoSet)
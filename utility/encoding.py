@@ -22,9 +22,12 @@
 import base58
 import binascii
 from copy import deepcopy
+from functools import lru_cache
 import hashlib
 import struct
+import time
 
+import config as cf
 from utility import util
 
 INFINITYLEN = 1
@@ -80,17 +83,19 @@ def double_sha256(string, as_hex=False):
 
 
 def bytes_to_hexstring(data, reverse=True):
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data)
     if reverse:
-        return ''.join(reversed(['{:02x}'.format(v) for v in data]))
+        return data[::-1].hex()
     else:
-        return ''.join(['{:02x}'.format(v) for v in data])
+        return data.hex()
 
 
 def hexstring_to_bytes(s: str, reverse=True):
     if reverse:
-        return bytes(reversed([int(s[x:x + 2], 16) for x in range(0, len(s), 2)]))
+        return bytes.fromhex(s)[::-1]
     else:
-        return bytes([int(s[x:x + 2], 16) for x in range(0, len(s), 2)])
+        return bytes.fromhex(s)
 
 
 def normalize_var(var, base=256):
@@ -159,8 +164,13 @@ def programhash_to_address(programhash):
     if isinstance(programhash, str):
         data = hexstring_to_bytes(programhash, reverse=False)
     else:
-        data = programhash
-    return base58.b58encode(data + double_sha256(data)[0:4]).decode()
+        data = bytes(programhash)
+    return _encode_address(data)
+
+
+@lru_cache(maxsize=cf.address_cache_size)
+def _encode_address(programhash: bytes) -> str:
+    return base58.b58encode(programhash + double_sha256(programhash)[0:4]).decode()
 
 
 def address_to_programhash(address: str, as_hex=True):
@@ -174,15 +184,32 @@ def address_to_programhash(address: str, as_hex=True):
 
     :return bytes, str: Public Key Hash
     """
+    if isinstance(address, bytes):
+        address = address.decode()
+    programhash, programhash_hex = _decode_address(address)
+    if as_hex:
+        return programhash_hex
+    else:
+        return programhash
+
+
+@lru_cache(maxsize=cf.address_cache_size)
+def _decode_address(address: str):
+    """
+    Decode the address and validate its checksum, the latest 'address_cache_size' addresses are kept.
+
+    :return tuple: Public Key Hash in bytes and in hexstring
+    """
     try:
         data = base58.b58decode(address.encode())
-    except EncodingError as err:
+    except ValueError as err:
         raise EncodingError("Invalid address %s: %s" % (address, err))
+    if len(data) != 25:
+        raise EncodingError("Invalid address %s: the length is %d" % (address, len(data)))
     programhash = data[:21]
-    if as_hex:
-        return programhash.hex()
-    else:
-        return programhash
+    if double_sha256(programhash)[0:4] != data[21:]:
+        raise EncodingError("Invalid address %s: checksum mismatch" % address)
+    return programhash, programhash.hex()
 
 
 def get_code_from_pb(public_key: str):
@@ -231,4 +258,45 @@ def encode_point(is_compressed, public_key_ECC):
 # common convert
 
 if __name__ == '__main__':
-    pass
+    # Benchmark building the outputs to the recurring voters with and without the caches
+    import random
+    from utility import encoding
+    from wallet import transaction as t
+
+    _count = 50000
+    _rnd = random.Random(0)
+    _addresses = [programhash_to_address(bytes([0x21]) + _rnd.getrandbits(160).to_bytes(20, byteorder="big"))
+                  for _ in range(2000)]
+    _receivers = [_rnd.choice(_addresses) for _ in range(_count)]
+
+    def _uncached_address_to_programhash(address, as_hex=True):
+        _programhash = _decode_address.__wrapped__(address)
+        return _programhash[1] if as_hex else _programhash[0]
+
+    def _build():
+        _start = time.time()
+        _outputs = [t.TxOutput(address=_add, value=1) for _add in _receivers]
+        _raw = [bytes_to_hexstring(_output.serialize(), reverse=False) for _output in _outputs]
+        return time.time() - _start, _raw
+
+    _cached = encoding.address_to_programhash
+    encoding.address_to_programhash = _uncached_address_to_programhash
+    _elapsed, _rawUncached = _build()
+    print(f"uncached: {_count} outputs in {_elapsed:.3f}s")
+    encoding.address_to_programhash = _cached
+    _build()
+    _elapsedCached, _rawCached = _build()
+    print(f"cached: {_count} outputs in {_elapsedCached:.3f}s, {encoding._decode_address.cache_info()}")
+    print(f"The outputs are the same: {_rawUncached == _rawCached}, speedup: {_elapsed / _elapsedCached:.1f}x")
+
+    _data = _rnd.getrandbits(8 << 20).to_bytes(1 << 20, byteorder="big")
+    _start = time.time()
+    _hex = ''.join(reversed(['{:02x}'.format(v) for v in _data]))
+    _back = bytes(reversed([int(_hex[x:x + 2], 16) for x in range(0, len(_hex), 2)]))
+    _elapsedList = time.time() - _start
+    _start = time.time()
+    _sameHex = bytes_to_hexstring(_data) == _hex
+    _sameBytes = hexstring_to_bytes(_hex) == _back == _data
+    _elapsedHex = time.time() - _start
+    print(f"hex codec of 1MB: {_elapsedList:.3f}s with the lists of ints, {_elapsedHex:.3f}s with bytes.fromhex/hex, "
+          f"the same: {_sameHex and _sameBytes}")
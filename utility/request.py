@@ -9,7 +9,10 @@
 @time: 2019-07-03 06:37
 """
 
+import threading
+
 import requests
+from requests.adapters import HTTPAdapter
 from retrying import retry
 
 import config as cf
@@ -18,12 +21,49 @@ from utility import util
 api_votes_height = "/api/1/dpos/producer/"
 api_rank_height = "/api/1/dpos/rank/height/"
 
+_sessions = {}
+_sessions_lock = threading.Lock()
+# The endpoints which reject the batch request, the single requests are sent to them directly
+_batch_unsupported = set()
+
+
+def get_session(name: str) -> requests.Session:
+    """
+    Get the keep-alive session with a connection pool of 'http_pool_size'. The session is created at the first call
+    and shared by all threads afterwards, so the connections to the same server are reused.
+    :param name: The name of the session, "rpc" for the node and "api" for the vote api. The rpc session carries the
+        authentication of 'rpc_user' and 'rpc_password'
+    :return: The shared session
+    """
+    _session = _sessions.get(name)
+    if _session is None:
+        with _sessions_lock:
+            _session = _sessions.get(name)
+            if _session is None:
+                _session = requests.Session()
+                _adapter = HTTPAdapter(pool_connections=1, pool_maxsize=cf.http_pool_size, pool_block=True)
+                _session.mount("http://", _adapter)
+                _session.mount("https://", _adapter)
+                if name == "rpc":
+                    _session.auth = requests.auth.HTTPBasicAuth(cf.rpc_user, cf.rpc_password)
+                if not cf.http_keep_alive:
+                    _session.headers["Connection"] = "close"
+                _sessions[name] = _session
+    return _session
+
+
+def get_rpc_session() -> requests.Session:
+    return get_session("rpc")
+
+
+def get_api_session() -> requests.Session:
+    return get_session("api")
+
 
 def post_request(ip: str, port: int, method, params={}, user="", password=""):
     try:
-        resp = requests.post("http://" + ip + ":" + str(port), json={"method": method, "params": params},
-                             headers={"content-type": "application/json"},
-                             auth=requests.auth.HTTPBasicAuth(cf.rpc_user, cf.rpc_password))
+        resp = get_rpc_session().post("http://" + ip + ":" + str(port), json={"method": method, "params": params},
+                                      headers={"content-type": "application/json"}, timeout=cf.http_timeout)
         if resp.status_code == 200:
             return resp.json()
         else:
@@ -34,6 +74,56 @@ def post_request(ip: str, port: int, method, params={}, user="", password=""):
         return None
 
 
+def post_batch_request(ip: str, port: int, calls: list, user="", password=""):
+    """
+    Send several rpc calls to the node in one JSON-RPC batch request.
+    :param ip: The ip of the node
+    :param port: The rpc port of the node
+    :param calls: A list of (method, params)
+    :return: A list of the responses in the same order as calls, the item is None if the call failed.
+        If the whole batch request failed, or the node doesn't support it, None is returned.
+    """
+    _endpoint = f"{ip}:{port}"
+    if _endpoint in _batch_unsupported:
+        return None
+    _batch = [{"jsonrpc": "2.0", "id": _id, "method": _method, "params": _params} for _id, (_method, _params) in
+              enumerate(calls)]
+    try:
+        resp = get_rpc_session().post("http://" + ip + ":" + str(port), json=_batch,
+                                      headers={"content-type": "application/json"}, timeout=cf.http_timeout)
+        if resp.status_code != 200:
+            util.feedback(content=resp.status_code, level=util.WARNING, module="RPC")
+            if 400 <= resp.status_code < 500:
+                # The node rejects the batch request
+                _batch_unsupported.add(_endpoint)
+                util.feedback(content=f"Batch request is not supported by {_endpoint}, send single requests instead",
+                              level=util.WARNING, module="RPC")
+            return None
+        _items = resp.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        util.feedback(content=e.__str__(), level=util.WARNING, module="RPC")
+        return None
+
+    if not isinstance(_items, list):
+        # The node doesn't support the batch request
+        _batch_unsupported.add(_endpoint)
+        util.feedback(content=f"Batch request is not supported by {_endpoint}, send single requests instead: {_items}",
+                      level=util.WARNING, module="RPC")
+        return None
+    results = [None] * len(calls)
+    for _item in _items:
+        _id = _item.get("id") if isinstance(_item, dict) else None
+        if not isinstance(_id, int) or not 0 <= _id < len(calls):
+            util.feedback(content=f"Unknown item in the batch response: {_item}", level=util.WARNING, module="RPC")
+            continue
+        if _item.get("error") is not None:
+            util.feedback(content=f"{calls[_id][0]} {calls[_id][1]} failed: {_item['error']}", level=util.WARNING,
+                          module="RPC")
+            continue
+        results[_id] = _item
+    return results
+
+
 @retry(stop_max_attempt_number=5)
 def get_block_height(url=cf.node_url, port=cf.node_rpc, user="", password=""):
     resp = post_request(url, port, "getcurrentheight", params={}, user=user, password=password)
@@ -52,6 +142,46 @@ def get_block_by_height(url=cf.node_url, port=cf.node_rpc, height=0, user="", pa
         return resp
 
 
+def get_blocks_by_height(heights: list, url=cf.node_url, port=cf.node_rpc, user="", password=""):
+    """
+    Get the blocks at the specified heights in one batch request.
+    :return: A list of the blocks in the order of heights, the item is None if the block is not returned.
+        If the whole batch request failed, None is returned.
+    """
+    resp = post_batch_request(url, port, [("getblockbyheight", {"height": _hei}) for _hei in heights], user=user,
+                              password=password)
+    if resp is not None:
+        return [None if _item is None else _item["result"] for _item in resp]
+    else:
+        return resp
+
+
+def get_raw_blocks_by_height(heights: list, url=cf.node_url, port=cf.node_rpc, user="", password=""):
+    """
+    Get the raw data of the blocks at the specified heights. The hashes of the blocks are fetched together with the
+    current height in one batch request, then the raw blocks are fetched in another one.
+    :return: The current height and a list of the raw blocks in hex in the order of heights, the item is None if the
+        block is not returned. If the whole batch request failed, None is returned.
+    """
+    _calls = [("getcurrentheight", {})] + [("getblockhash", {"height": _hei}) for _hei in heights]
+    resp = post_batch_request(url, port, _calls, user=user, password=password)
+    if resp is None or resp[0] is None:
+        return None
+    currentHeight = resp[0]["result"]
+    _hashes = [None if _item is None else _item["result"] for _item in resp[1:]]
+
+    _calls = [("getblock", {"blockhash": _hash, "verbosity": 0}) for _hash in _hashes if _hash is not None]
+    resp = post_batch_request(url, port, _calls, user=user, password=password) if _calls else []
+    if resp is None:
+        return None
+    _raws = iter(resp)
+    blocks = []
+    for _hash in _hashes:
+        _item = None if _hash is None else next(_raws)
+        blocks.append(None if _item is None else _item["result"])
+    return currentHeight, blocks
+
+
 @retry(stop_max_attempt_number=5)
 def get_balance(address: str, url=cf.node_url, port=cf.node_rpc, user="", password=""):
     if len(address) != 34:
@@ -75,6 +205,17 @@ def get_utxos_by_amount(address: str, amount: str, url=cf.node_url, port=cf.node
         return resp
 
 
+@retry(stop_max_attempt_number=5)
+def get_unspent_utxos(address: str, url=cf.node_url, port=cf.node_rpc, user="", password=""):
+    if len(address) != 34:
+        return None
+    resp = post_request(url, port, "listunspent", params={"addresses": [address]}, user=user, password=password)
+    if resp is not None:
+        return resp["result"]
+    else:
+        return resp
+
+
 @retry(stop_max_attempt_number=5)
 def send_tx(raw_tx: str, url=cf.node_url, port=cf.node_rpc, user="", password=""):
     resp = post_request(url, port, "sendrawtransaction", params={"data": raw_tx}, user=user, password=password)
@@ -96,7 +237,7 @@ def get_tx(tx_id: str, url=cf.node_url, port=cf.node_rpc, user="", password=""):
 
 def get_request(url: str):
     try:
-        resp = requests.get(url=url)
+        resp = get_api_session().get(url=url, timeout=cf.http_timeout)
         if resp.status_code == 200:
             return resp.json()
         else:
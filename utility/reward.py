@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+@author: Bocheng.Zhang
+@license: MIT
+@contact: bocheng0000@gmail.com
+@file: reward.py
+@time: 2019-08-02 16:25
+"""
+
+from fractions import Fraction
+
+import numpy as np
+
+import config as cf
+
+
+def amount_to_distribute(reward: int):
+    """
+    Calculate the amount of the dpos reward to distribute in a round.
+    :param reward: The dpos reward of the node in sela
+    :return: The amount to distribute, it is rounded down to sela in the integer mode.
+    """
+    if cf.reward_integer_mode:
+        return int((reward - cf.operating_costs) * Fraction(str(cf.distribution_percent)))
+    return (reward - cf.operating_costs) * cf.distribution_percent
+
+
+def allocate(amount: int, votes: list, validVotes: int, keys: list) -> list:
+    """
+    Allocate the amount to the voters in proportion to their votes with integer arithmetic only. Each voter gets the
+    integer part of its share, and the sela left by the fractional parts are handed out one by one to the voters with
+    the largest remainders, the ties are broken by the key.
+    :param amount: The amount to allocate in sela
+    :param votes: The votes of each voter in sela
+    :param validVotes: The valid votes of the node, the amount is allocated per valid vote
+    :param keys: The keys of the voters to break the ties, usually the addresses
+    :return: The share of each voter in sela
+    """
+    if len(votes) == 0:
+        return []
+    if amount < 0 or max(amount, validVotes) >= 2 ** 61:
+        # out of the range of the batched arithmetic below
+        _divmods = [divmod(amount * _vote, validVotes) for _vote in votes]
+        shares = np.array([_share for _share, _ in _divmods], dtype=object)
+        remainders = np.array([_remainder for _, _remainder in _divmods], dtype=object)
+    else:
+        # Estimate the shares with float, then get the exact remainders with int64 arithmetic. amount * vote
+        # overflows, but the remainder is the same modulo 2^64, and it is in (-2^63, 2^63) while the estimate is off by
+        # a few sela only, so the wrapped result is the exact remainder. Correct the estimate until the remainder
+        # is in [0, validVotes).
+        _votes = np.asarray(votes, dtype=np.int64)
+        shares = np.floor(_votes * (amount / validVotes)).astype(np.int64)
+        remainders = _votes * np.int64(amount) - shares * np.int64(validVotes)
+        while True:
+            _low = remainders < 0
+            _high = remainders >= validVotes
+            if not _low.any() and not _high.any():
+                break
+            shares[_low] -= 1
+            remainders[_low] += validVotes
+            shares[_high] += 1
+            remainders[_high] -= validVotes
+
+    # The voters get amount * sum(votes) / validVotes in total, rounded down
+    _leftover = amount * sum(votes) // validVotes - int(shares.sum())
+    if _leftover > 0:
+        # The voters whose remainders are larger than the threshold get 1 sela, and the voters whose remainders are
+        # equal to the threshold get the rest in the order of the keys.
+        _threshold = np.partition(remainders, len(remainders) - _leftover)[len(remainders) - _leftover]
+        _above = np.flatnonzero(remainders > _threshold)
+        _tied = sorted(np.flatnonzero(remainders == _threshold).tolist(), key=lambda _i: keys[_i])
+        shares[_above] += 1
+        shares[_tied[:_leftover - len(_above)]] += 1
+    return shares.tolist()
+
+
+class RewardMatrix:
+    """
+    The votes of all rounds in a distribution cycle, kept in a dense matrix of rounds x voters.
+    Each voter's address is mapped to a column, and each round's reward per vote is kept in a rate vector.
+    In the integer mode, each round's amount is allocated exactly in sela instead, see allocate.
+    """
+
+    def __init__(self):
+        self.rounds = []
+        self.addresses = []
+        self._columns = {}
+        self._rates = []
+        self._amounts = []
+        self._validVotes = []
+        self._votes = []
+
+    def add_round(self, round: int, amount, voters: dict, totalVotes: int):
+        """
+        Add the voters of a dpos round.
+        :param round: The index of the dpos round
+        :param amount: The amount of the reward to distribute in this round, in sela
+        :param voters: The voters of this round, see util.getVotersByHeight
+        :param totalVotes: The total votes of the node in this round, in sela
+        :return: None
+        """
+        validVotes = totalVotes + cf.investorsVotes
+        _columns = []
+        _votes = []
+        for _add, _voter in voters.items():
+            if _add in cf.ignoreAddress:
+                continue
+            _column = self._columns.get(_add)
+            if _column is None:
+                _column = len(self.addresses)
+                self._columns[_add] = _column
+                self.addresses.append(_add)
+            _columns.append(_column)
+            _votes.append(_voter["Votes"])
+        self.rounds.append(round)
+        self._rates.append(amount / validVotes)
+        self._amounts.append(amount)
+        self._validVotes.append(validVotes)
+        self._votes.append((np.array(_columns, dtype=np.int64), np.array(_votes, dtype=np.int64)))
+
+    def calculate(self):
+        """
+        Calculate the reward of each voter in each round, and sum them up.
+        :return:
+            rewards: A dict, key: the voter's address, value: the total reward in sela
+            roundTotals: A dict, key: the index of the dpos round, value: the reward distributed in this round
+        """
+        if cf.reward_integer_mode:
+            return self._calculate_exact()
+        votes = np.zeros((len(self.rounds), len(self.addresses)), dtype=np.float64)
+        for _row, (_columns, _votes) in enumerate(self._votes):
+            votes[_row, _columns] = _votes
+        rewardMatrix = votes * np.array(self._rates, dtype=np.float64)[:, np.newaxis]
+
+        # Add the rounds one by one in round order, the same order as the rewards of each round were added up before,
+        # so the totals are exactly the same float values.
+        totals = np.zeros(len(self.addresses), dtype=np.float64)
+        for _row in rewardMatrix:
+            totals += _row
+        rewards = dict(zip(self.addresses, totals.tolist()))
+        roundTotals = dict(zip(self.rounds, rewardMatrix.sum(axis=1).tolist()))
+        return rewards, roundTotals
+
+    def _calculate_exact(self):
+        totals = np.zeros(len(self.addresses), dtype=np.int64)
+        roundTotals = {}
+        for _round, _amount, _validVotes, (_columns, _votes) in zip(self.rounds, self._amounts, self._validVotes,
+                                                                    self._votes):
+            _shares = allocate(int(_amount), _votes.tolist(), _validVotes,
+                               [self.addresses[_column] for _column in _columns.tolist()])
+            # The columns of a round are unique
+            totals[_columns] += np.array(_shares, dtype=np.int64)
+            roundTotals[_round] = sum(_shares)
+        rewards = dict(zip(self.addresses, totals.tolist()))
+        return rewards, roundTotals
@@ -25,6 +25,85 @@ class MessageChecksumFailure(Exception):
     pass
 
 
+_uint16 = struct.Struct("<H")
+_uint32 = struct.Struct("<L")
+_uint64 = struct.Struct("<Q")
+
+
+class ByteReader:
+    """
+    A cursor over the data to unserialize. Each field is read at the offset of the cursor, so the rest of the data is
+    never copied and a whole block or transaction is parsed in linear time.
+    """
+
+    def __init__(self, data, offset=0):
+        self._data = data
+        self.view = memoryview(data)
+        self.offset = offset
+
+    def _advance(self, n: int) -> int:
+        start = self.offset
+        if n < 0 or start + n > len(self.view):
+            raise SerializeDataTooShort()
+        self.offset = start + n
+        return start
+
+    def remaining(self) -> int:
+        return len(self.view) - self.offset
+
+    def rest(self):
+        """
+        :return: The data which is not read yet, a view without copy if the data is a memoryview, else bytes
+        """
+        if isinstance(self._data, memoryview):
+            return self.view[self.offset:]
+        return self.view[self.offset:].tobytes()
+
+    def skip(self, n: int):
+        self._advance(n)
+
+    def read(self, n: int) -> bytes:
+        _start = self._advance(n)
+        return self.view[_start:_start + n].tobytes()
+
+    def peek_uint8(self) -> int:
+        if self.offset >= len(self.view):
+            raise SerializeDataTooShort()
+        return self.view[self.offset]
+
+    def read_uint8(self) -> int:
+        return self.view[self._advance(1)]
+
+    def read_uint16(self) -> int:
+        return _uint16.unpack_from(self.view, self._advance(2))[0]
+
+    def read_uint32(self) -> int:
+        return _uint32.unpack_from(self.view, self._advance(4))[0]
+
+    def read_uint64(self) -> int:
+        return _uint64.unpack_from(self.view, self._advance(8))[0]
+
+    def read_variable_int(self) -> int:
+        i = self.read_uint8()
+        if i < 0xfd:
+            return i
+        elif i == 0xfd:
+            return self.read_uint16()
+        elif i == 0xfe:
+            return self.read_uint32()
+        else:
+            return self.read_uint64()
+
+    def read_bytes(self) -> bytes:
+        return self.read(self.read_variable_int())
+
+    def skip_bytes(self):
+        self.skip(self.read_variable_int())
+
+    def read_string(self) -> str:
+        return self.read_bytes().decode('utf8')
+
+
 class Serialize:
     @staticmethod
     def serialize_variable_int(i):
@@ -48,23 +127,8 @@ class Serialize:
 
     @staticmethod
     def unserialize_variable_int(data):
-        if len(data) == 0:
-            raise SerializeDataTooShort()
-        i = data[0]
-        if i < 0xfd:
-            return i, data[1:]
-        elif i == 0xfd:
-            if len(data) < 3:
-                raise SerializeDataTooShort()
-            return struct.unpack("<H", data[1:3])[0], data[3:]
-        elif i == 0xfe:
-            if len(data) < 5:
-                raise SerializeDataTooShort()
-            return struct.unpack("<L", data[1:5])[0], data[5:]
-        else:
-            if len(data) < 9:
-                raise SerializeDataTooShort()
-            return struct.unpack("<Q", data[1:9])[0], data[9:]
+        reader = ByteReader(data)
+        return reader.read_variable_int(), reader.rest()
 
     @staticmethod
     def serialize_bytes(b):
@@ -73,9 +137,8 @@ class Serialize:
 
     @staticmethod
     def unserialize_bytes(data):
-        length, data = Serialize.unserialize_variable_int(data)
-        b = data[:length]
-        return b, data[length:]
+        reader = ByteReader(data)
+        return reader.read_bytes(), reader.rest()
 
     @staticmethod
     def serialize_uint168(data):
@@ -87,8 +150,8 @@ class Serialize:
 
     @staticmethod
     def unserialize_string(data):
-        s, data = Serialize.unserialize_bytes(data)
-        return s.decode('utf8'), data
+        reader = ByteReader(data)
+        return reader.read_string(), reader.rest()
 
     @staticmethod
     def serialize_object(o):
@@ -105,17 +168,23 @@ class Serialize:
 
     @staticmethod
     def unserialize_object(data):
-        t = bytes([data[0]])
+        reader = ByteReader(data)
+        return Serialize.read_object(reader), reader.rest()
+
+    @staticmethod
+    def read_object(reader: ByteReader):
+        t = bytes([reader.read_uint8()])
         if t == b'v':
-            return Serialize.unserialize_variable_int(data[1:])
+            return reader.read_variable_int()
         elif t == b'b':
-            return Serialize.unserialize_bytes(data[1:])
+            return reader.read_bytes()
         elif t == b's':
-            return Serialize.unserialize_string(data[1:])
+            return reader.read_string()
         elif t == b'l':
-            return Serialize.unserialize_list(data[1:])
+            return Serialize.read_list(reader)
         elif t == b'd':
-            return Serialize.unserialize_dict(data[1:])
+            return Serialize.read_dict(reader)
+        raise ValueError(f"unsupported object type {t}")
 
     @staticmethod
     def serialize_list(items):
@@ -127,12 +196,16 @@ class Serialize:
 
     @staticmethod
     def unserialize_list(data):
-        count, data = Serialize.unserialize_variable_int(data)
+        reader = ByteReader(data)
+        return Serialize.read_list(reader), reader.rest()
+
+    @staticmethod
+    def read_list(reader: ByteReader):
+        count = reader.read_variable_int()
         r = []
         for _ in range(count):
-            item, data = Serialize.unserialize_object(data)
-            r.append(item)
-        return r, data
+            r.append(Serialize.read_object(reader))
+        return r
 
     @staticmethod
     def serialize_dict(d):
@@ -145,13 +218,17 @@ class Serialize:
 
     @staticmethod
     def unserialize_dict(data):
-        count, data = Serialize.unserialize_variable_int(data)
+        reader = ByteReader(data)
+        return Serialize.read_dict(reader), reader.rest()
+
+    @staticmethod
+    def read_dict(reader: ByteReader):
+        count = reader.read_variable_int()
         r = {}
         for _ in range(count):
-            k, data = Serialize.unserialize_object(data)
-            v, data = Serialize.unserialize_object(data)
-            r[k] = v
-        return r, data
+            k = Serialize.read_object(reader)
+            r[k] = Serialize.read_object(reader)
+        return r
 
     @staticmethod
     def serialize_network_address(address, services, with_timestamp=True):
@@ -9,15 +9,21 @@
 @time: 2019-07-02 21:39
 """
 
-from copy import deepcopy
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
+import glob
+import json
 import linecache
 import logging
 import os
+import threading
 import time
 
 import config as cf
-from utility import request
+from utility import cache, encoding, request, reward
 from wallet import transaction as t
+from wallet import block as b
 
 
 # OS
@@ -50,8 +56,10 @@ CRITICAL = 4
 
 check_dir(cf.log_path)
 log_file = f"{cf.log_path}/dposreward_{time.strftime('%m%d%H%M', time.gmtime(time.time()))}.log"
-logging.basicConfig(filename=log_file, filemode="a", format="%(asctime)s %(name)s:%(levelname)s:%(message)s",
-                    datefmt="%a, %d %b %Y %H:%M:%S", level=logging.INFO)
+# the log file is created at the first record, so the program which logs nothing leaves no log file
+logging.basicConfig(handlers=[logging.FileHandler(log_file, mode="a", delay=True)],
+                    format="%(asctime)s %(name)s:%(levelname)s:%(message)s", datefmt="%a, %d %b %Y %H:%M:%S",
+                    level=logging.INFO)
 
 
 def feedback(content: str, level=INFO, module="UTL"):
@@ -76,76 +84,345 @@ def feedback(content: str, level=INFO, module="UTL"):
         logger.critical(content)
 
 
+def getProducers() -> list:
+    """
+    get the profiles of the dpos nodes whose reward is distributed by this program
+    :return: A list of dicts
+        name: the name of the dpos node
+        dposRewardAddress, ownerPublicKey: the dpos node's reward address and owner public key
+        address, public_key, private_key: the account for the distribution
+        MsgForMemo: the message in the memo of the distribution transaction
+        dpos_record_file, distribution_record_file, scan_state_file: the record files of the dpos node
+
+        If 'producers' in config is empty, the only profile is made of the parameters of the single dpos node.
+    """
+    if len(cf.producers) == 0:
+        return [{"name": "", "dposRewardAddress": cf.dposRewardAddress, "ownerPublicKey": cf.ownerPublicKey,
+                 "address": cf.address, "public_key": cf.public_key, "private_key": cf.private_key,
+                 "MsgForMemo": cf.MsgForMemo, "dpos_record_file": cf.dpos_record_file,
+                 "distribution_record_file": cf.distribution_record_file, "scan_state_file": cf.scan_state_file}]
+    producers = []
+    for _profile in cf.producers:
+        _name = _profile["name"]
+        _producer = {"MsgForMemo": cf.MsgForMemo, "dpos_record_file": f"{_name}_{cf.dpos_record_file}",
+                     "distribution_record_file": f"{_name}_{cf.distribution_record_file}",
+                     "scan_state_file": f"{_name}_{cf.scan_state_file}"}
+        _producer.update(_profile)
+        producers.append(_producer)
+    return producers
+
+
+def getProducer(producer=None) -> dict:
+    """
+    return the profile of the dpos node, the first one in getProducers if it is None
+    """
+    return getProducers()[0] if producer is None else producer
+
+
 def getVotersByHeight(ownerPb: str, hei: int) -> dict:
     # get the information of voters at the specified height for the owner
-    _votersInfo = request.get_voters_by_height(ownerPublickey=ownerPb, height=hei)
+    _snapshot = getVoteSnapshotByHeight(ownerPb=ownerPb, hei=hei)
 
-    if "" in cf.investors.keys():
-        voters = {}
-    else:
-        voters = deepcopy(cf.investors)
-    if _votersInfo is not None:
-        for _voter in _votersInfo:
-            _add = _voter["Address"]
-            if _add in cf.ignoreAddress:
+    if _snapshot is not None:
+        for _add in cf.ignoreAddress:
+            if _add in _snapshot.keys():
                 feedback(content=f"{_add} is in the blacklist.", level=WARNING)
-                continue
-            elif len(_add) != 34:
-                feedback(content=f"{_add} is not standard address.", level=WARNING)
-                continue
-
-            _value = strElaToIntSela(_voter["Value"])
-            _txid = _voter["Txid"]
-            _producerPb = _voter["Producer_public_key"]
-            _txType = _voter["Vote_type"]
-            if _producerPb == ownerPb and _txType == "Delegate":
-                if _add not in voters.keys():
-                    # 该地址第一次被统计，或在投票统计中仅出现一次
-                    voters[_add] = {"Votes": _value, "Txid": [_txid]}
-                else:
-                    # 该地址使用不同的utxo同时进行了多次投票，或者接口结果有bug
-                    if _txid not in voters[_add]["Txid"]:
-                        voters[_add]["Votes"] += _value
-                        voters[_add]["Txid"].append(_txid)
-                    else:
-                        feedback(content="Error: API_MISC return Duplicate txid", level=ERROR)
-                        feedback(content=f"txid:{_txid}", level=ERROR)
-                        feedback(content=f"voter: add[{_add}] {voters[_add]}", level=ERROR)
-        return voters
+        return mergeInvestors(_snapshot)
     else:
         feedback(content=f"getVotersByHeight failed!{ownerPb},{hei}", level=ERROR)
         return None
 
 
-def getTotalVotesByHeight(ownerPb: str, hei: int) -> int:
-    producers = request.get_total_votes_by_height(height=hei)
-    if producers is not None:
-        for _p in producers:
-            _pb = _p["Ownerpublickey"]
-            if _pb == ownerPb:
-                return strElaToIntSela(_p["Value"])
+def mergeInvestors(snapshot: dict) -> dict:
+    """
+    add the node investors to the voters, the voters in the blacklist are removed
+    :param snapshot: the votes for the owner, see getVoteSnapshotByHeight. It isn't modified.
+    :return: A dict, the same as the snapshot
+    """
+    if "" in cf.investors.keys():
+        voters = {}
+    else:
+        voters = {_add: {"Votes": _investor["Votes"], "Txid": list(_investor["Txid"])} for _add, _investor in
+                  cf.investors.items()}
+    for _add, _voter in snapshot.items():
+        if _add in cf.ignoreAddress:
+            continue
+        if _add not in voters.keys():
+            voters[_add] = {"Votes": _voter["Votes"], "Txid": list(_voter["Txid"])}
+        else:
+            # The investor votes for the node too
+            voters[_add]["Votes"] += _voter["Votes"]
+            voters[_add]["Txid"] += _voter["Txid"]
+    return voters
+
+
+def getVoteSnapshotByHeight(ownerPb: str, hei: int) -> dict:
+    """
+    get the votes for the owner at the specified height. The votes are read from the vote cache first, and the votes
+    fetched from the api server are cached if they are not empty and the height is deep enough, see isDeepEnough.
+    :param ownerPb: the owner public key of the dpos node
+    :param hei: the vote height
+    :return: A dict
+        key: the voter's address
+        value: the votes in sela and the txids of the votes
+    """
+    _voteCache = cache.get_vote_cache()
+    snapshot = _voteCache.get_voters(ownerPb, hei)
+    if snapshot is not None:
+        return snapshot
+
+    _votersInfo = request.get_voters_by_height(ownerPublickey=ownerPb, height=hei)
+    if _votersInfo is None:
         return None
+    if not isinstance(_votersInfo, list):
+        feedback(content=f"Unexpected voters at height[{hei}]: {_votersInfo}", level=ERROR)
+        return None
+    snapshot = {}
+    for _voter in _votersInfo:
+        if not isinstance(_voter, dict) or not {"Address", "Value", "Txid", "Producer_public_key",
+                                                "Vote_type"}.issubset(_voter.keys()):
+            feedback(content=f"Unexpected voter at height[{hei}]: {_voter}", level=WARNING)
+            continue
+        _add = _voter["Address"]
+        if not isinstance(_add, str) or len(_add) != 34:
+            feedback(content=f"{_add} is not standard address.", level=WARNING)
+            continue
+        try:
+            # the conversion is cached, so the output to this address is built without decoding it again
+            encoding.address_to_programhash(_add)
+        except encoding.EncodingError:
+            feedback(content=f"{_add} is not a valid address, its votes are ignored.", level=WARNING)
+            continue
+
+        _value = strElaToIntSela(_voter["Value"])
+        _txid = _voter["Txid"]
+        _producerPb = _voter["Producer_public_key"]
+        _txType = _voter["Vote_type"]
+        if _producerPb == ownerPb and _txType == "Delegate":
+            if _add not in snapshot.keys():
+                # 该地址第一次被统计，或在投票统计中仅出现一次
+                snapshot[_add] = {"Votes": _value, "Txid": [_txid]}
+            else:
+                # 该地址使用不同的utxo同时进行了多次投票，或者接口结果有bug
+                if _txid not in snapshot[_add]["Txid"]:
+                    snapshot[_add]["Votes"] += _value
+                    snapshot[_add]["Txid"].append(_txid)
+                else:
+                    feedback(content="Error: API_MISC return Duplicate txid", level=ERROR)
+                    feedback(content=f"txid:{_txid}", level=ERROR)
+                    feedback(content=f"voter: add[{_add}] {snapshot[_add]}", level=ERROR)
+    if len(snapshot) > 0 and isDeepEnough(hei):
+        _voteCache.put_voters(ownerPb, hei, snapshot)
+    return snapshot
+
+
+_bestHeight = 0
+
+
+def isDeepEnough(hei: int) -> bool:
+    """
+    check whether the height has at least 'cache_confirmations' confirmations, so the votes at this height can be
+    cached. The best height is only requested when the last one known is not high enough.
+    :param hei: the vote height
+    :return: True if the height is deep enough
+    """
+    global _bestHeight
+    if _bestHeight - hei + 1 < cf.cache_confirmations:
+        try:
+            _height = request.get_block_height()
+        except Exception as e:
+            feedback(content=f"Failed to get the current height: {e}", level=WARNING)
+            _height = None
+        if _height is not None:
+            _bestHeight = max(_bestHeight, _height)
+    return _bestHeight - hei + 1 >= cf.cache_confirmations
+
+
+def getTotalVotesByHeight(ownerPb: str, hei: int) -> int:
+    _index = getRankIndexByHeight(hei=hei)
+    if _index is not None:
+        return _index.get(ownerPb)
     else:
         feedback(content="getTotalVotesByHeight failed!", level=ERROR)
         return None
 
 
-def getCoinbaseByHeight(hei: int) -> dict:
+_rankIndex = OrderedDict()
+_rankIndexLock = threading.Lock()
+
+
+def getRankIndexByHeight(hei: int) -> dict:
+    """
+    get the producer rank at the specified height indexed by the owner public key. The rank of each height is
+    downloaded and parsed once, and shared by all the callers, the latest 'rank_index_size' heights are kept.
+    :param hei: the vote height
+    :return: A dict
+        key: the owner public key
+        value: the total votes in sela
+    """
+    with _rankIndexLock:
+        _future = _rankIndex.get(hei)
+        _owner = _future is None
+        if _owner:
+            _future = Future()
+            _rankIndex[hei] = _future
+            while len(_rankIndex) > cf.rank_index_size:
+                _rankIndex.popitem(last=False)
+    if not _owner:
+        return _future.result()
+
+    try:
+        _rank = getRankByHeight(hei=hei)
+    except BaseException as e:
+        _future.set_exception(e)
+        with _rankIndexLock:
+            _rankIndex.pop(hei, None)
+        raise
+    if _rank is None:
+        _index = None
+        with _rankIndexLock:
+            # download it again at the next call
+            _rankIndex.pop(hei, None)
+    else:
+        _index = indexRank(_rank)
+    _future.set_result(_index)
+    return _index
+
+
+def indexRank(rank: list) -> dict:
+    """
+    index the producer rank by the owner public key
+    :param rank: the producer rank, see getRankByHeight
+    :return: A dict
+        key: the owner public key
+        value: the total votes in sela
+    """
+    index = {}
+    for _pb, _value in rank:
+        index.setdefault(_pb, strElaToIntSela(_value))
+    return index
+
+
+def getRankByHeight(hei: int) -> list:
+    """
+    get the producer rank at the specified height. The rank is read from the vote cache first, and the rank fetched
+    from the api server is cached if it is not empty and the height is deep enough, see isDeepEnough.
+    :param hei: the vote height
+    :return: A list of the producers' owner public keys and votes in ela
+    """
+    _voteCache = cache.get_vote_cache()
+    rank = _voteCache.get_rank(hei)
+    if rank is not None:
+        return rank
+
+    _producers = request.get_total_votes_by_height(height=hei)
+    if _producers is None:
+        return None
+    if not isinstance(_producers, list) or not all(
+            isinstance(_p, dict) and "Ownerpublickey" in _p and "Value" in _p for _p in _producers):
+        feedback(content=f"Unexpected producer rank at height[{hei}]: {_producers}", level=ERROR)
+        return None
+    rank = [[_p["Ownerpublickey"], _p["Value"]] for _p in _producers]
+    if len(rank) > 0 and isDeepEnough(hei):
+        _voteCache.put_rank(hei, rank)
+    return rank
+
+
+def prefetchVotesByHeight(ownerPb: str, heights: list) -> dict:
+    """
+    get the voters and the total votes at the specified heights for the owner concurrently, at most
+    'vote_fetch_workers' requests are sent at the same time
+    :param ownerPb: the owner public key of the dpos node
+    :param heights: the vote heights, the duplicate heights are fetched once
+    :return: A dict
+        key: the vote height
+        value: the voters and the total votes, see getVotersByHeight and getTotalVotesByHeight
+    """
+    _heights = list(dict.fromkeys(heights))
+    with ThreadPoolExecutor(max_workers=cf.vote_fetch_workers) as executor:
+        _voters = {_hei: executor.submit(getVotersByHeight, ownerPb, _hei) for _hei in _heights}
+        _totalVotes = {_hei: executor.submit(getTotalVotesByHeight, ownerPb, _hei) for _hei in _heights}
+        return {_hei: (_voters[_hei].result(), _totalVotes[_hei].result()) for _hei in _heights}
+
+
+def getBlockSummaryByHeight(hei: int) -> dict:
     """
-    get the coinbase transaction at the specified height
+    get the timestamp and the coinbase's outputs of the block at the specified height. The block is read from the
+    local cache first, and the block fetched from the node is cached once it is deep enough.
     :param hei: the specified height
-    :return: A dict representing the block data.
+    :return: A dict
+        time: the timestamp of the block
+        vout: the coinbase's outputs, each output has the address and the value
     """
+    return getBlockSummaries([hei])[0]
 
-    # get the block at the specified height
-    _block = request.get_block_by_height(height=hei)
-    # get all transactions in the block
-    _txs = _block["tx"]
 
-    # The coinbase transaction must be the first transaction and type 0
-    _coinbase = _txs[0]
+def getBlockSummaries(heights: list) -> list:
+    """
+    get the timestamps and the coinbase's outputs of the blocks at the specified heights. The blocks which are not
+    cached are fetched from the node in batch requests.
+    :param heights: the specified heights
+    :return: A list of the block summaries in the order of heights, see getBlockSummaryByHeight
+    """
+    _blockCache = cache.get_block_cache()
+    summaries = [_blockCache.get_block(_hei) for _hei in heights]
+    _missing = [_hei for _hei, _summary in zip(heights, summaries) if _summary is None]
+    if len(_missing) == 0:
+        return summaries
+
+    _fetched = {}
+    if cf.raw_block_fetch:
+        # fetch the raw blocks and decode the coinbase transactions locally
+        _resp = request.get_raw_blocks_by_height(heights=_missing)
+        if _resp is not None:
+            _currentHeight, _raws = _resp
+            for _hei, _raw in zip(_missing, _raws):
+                if _raw is not None:
+                    _fetched[_hei] = summarizeRawBlock(_hei, _raw, confirmations=_currentHeight - _hei + 1)
+    elif len(_missing) > 1:
+        _blocks = request.get_blocks_by_height(heights=_missing)
+        if _blocks is not None:
+            for _hei, _block in zip(_missing, _blocks):
+                if _block is not None:
+                    _fetched[_hei] = summarizeBlock(_hei, _block)
+    for _hei in _missing:
+        if _hei not in _fetched:
+            # fall back to the single request which will be retried
+            _fetched[_hei] = summarizeBlock(_hei, request.get_block_by_height(height=_hei))
+    return [_fetched[_hei] if _summary is None else _summary for _hei, _summary in zip(heights, summaries)]
+
+
+def summarizeBlock(hei: int, block: dict) -> dict:
+    """
+    keep the timestamp and the coinbase's outputs of the block, and cache them if the block is deep enough
+    :param hei: the height of the block
+    :param block: the block returned by the node
+    :return: the block summary, see getBlockSummaryByHeight
+    """
+    _coinbase = block["tx"][0]
     assert _coinbase["type"] == 0
-    return _coinbase
+    _summary = {"time": block["time"],
+                "vout": [{"address": _vout["address"], "value": _vout["value"]} for _vout in _coinbase["vout"]]}
+    if block.get("confirmations", 0) >= cf.cache_confirmations:
+        cache.get_block_cache().put_block(hei, _summary["time"], _summary["vout"])
+    return _summary
+
+
+def summarizeRawBlock(hei: int, raw: str, confirmations: int) -> dict:
+    """
+    decode the header and the coinbase transaction of the raw block, and cache them if the block is deep enough
+    :param hei: the height of the block
+    :param raw: the raw data of the block in hex
+    :param confirmations: the number of the block's confirmations
+    :return: the block summary, see getBlockSummaryByHeight
+    """
+    _header, _coinbase = b.Block.unserialize_coinbase(bytes.fromhex(raw))
+    assert _header.height == hei
+    _summary = {"time": _header.timestamp,
+                "vout": [{"address": _vout.address(), "value": SelaToEla(_vout.value)} for _vout in _coinbase.outputs]}
+    if confirmations >= cf.cache_confirmations:
+        cache.get_block_cache().put_block(hei, _summary["time"], _summary["vout"])
+    return _summary
 
 
 def getCoinbaseOutput(hei: int) -> list:
@@ -154,22 +431,50 @@ def getCoinbaseOutput(hei: int) -> list:
     :param hei: the specified height
     :return: coinbase's outputs
     """
-    _coinbase = getCoinbaseByHeight(hei)
-    return _coinbase["vout"]
+    return getBlockSummaryByHeight(hei)["vout"]
 
 
-def getDposRewardByHeight(hei: int, add=cf.dposRewardAddress) -> int:
+def iterCoinbaseOutput(firstHeight: int, lastHeight: int):
+    """
+    iterate the coinbase's outputs from firstHeight to lastHeight (not included) in height order. The blocks are
+    fetched in batches of 'rpc_batch_size' by a thread pool which keeps at most 'fetch_window' blocks ahead of the
+    block being consumed.
+    :param firstHeight: the first height to be fetched
+    :param lastHeight: the height where the iteration stops, it is not included
+    :return: a generator of (height, coinbase's outputs)
+    """
+    with ThreadPoolExecutor(max_workers=cf.fetch_workers) as executor:
+        _pending = deque()
+        _next = firstHeight
+        try:
+            while _pending or _next < lastHeight:
+                # keep the sliding window full
+                while _next < lastHeight and len(_pending) * cf.rpc_batch_size < cf.fetch_window:
+                    _heights = list(range(_next, min(_next + cf.rpc_batch_size, lastHeight)))
+                    _pending.append((_heights, executor.submit(getBlockSummaries, _heights)))
+                    _next = _heights[-1] + 1
+                _heights, _future = _pending.popleft()
+                for _hei, _summary in zip(_heights, _future.result()):
+                    yield _hei, _summary["vout"]
+        finally:
+            # the consumer stopped early or failed, drop the blocks which are not started yet
+            for _, _future in _pending:
+                _future.cancel()
+
+
+def getDposRewardByHeight(hei: int, add=cf.dposRewardAddress, vouts=None) -> int:
     """
     get the specified node's dpos reward at the specified height
     :param hei: the specified height of the dpos reward
     :param add: the address of the specified dpos node
+    :param vouts: the coinbase's outputs at the specified height if they have been fetched already
     :return: the reward in sela
 
         If the node's address is not in the coinbase's outputs, 0 is returned.
     """
 
     # get the coinbase's output at the specified height
-    _vouts = getCoinbaseOutput(hei)
+    _vouts = getCoinbaseOutput(hei) if vouts is None else vouts
     for _vout in _vouts:
         # if the dpos node's address is in coinbase's outputs, convert the output's value to sela and return
         if _vout["address"] == add:
@@ -181,15 +486,23 @@ def getDposRewardByHeight(hei: int, add=cf.dposRewardAddress) -> int:
 def caleRewardByVoter(amount: int, voters: dict, totalVotes: int) -> dict:
     validVotes = totalVotes + cf.investorsVotes
     _rewardPerVote = amount / validVotes
+    _integerMode = cf.reward_integer_mode
 
     rewards = {}
     for _add in voters.keys():
         if _add in cf.ignoreAddress:
             feedback(content=f"Address[{_add}] is ignored.")
             continue
+        elif _integerMode:
+            rewards[_add] = voters[_add]["Votes"]
         else:
             _vote = voters[_add]["Votes"]
             rewards[_add] = _vote * _rewardPerVote
+    if _integerMode:
+        # allocate the amount in sela exactly, the votes are replaced by the shares
+        _adds = list(rewards.keys())
+        _shares = reward.allocate(int(amount), list(rewards.values()), validVotes, _adds)
+        rewards = dict(zip(_adds, _shares))
     return rewards
 
 
@@ -228,7 +541,7 @@ def strElaToIntSela(value: str) -> int:
 
 # utility for time
 def get_block_date(height: int) -> str:
-    blockInfo = request.get_block_by_height(height=height)
+    blockInfo = getBlockSummaryByHeight(height)
     return timestamp_to_data(blockInfo["time"])
 
 
@@ -260,20 +573,22 @@ def gen_output_by_receiver(receivers: dict):
         return outputs
 
 
-def get_last_distribution_record():
+def get_last_distribution_record(producer=None):
     """
     Get the last record of the dpos reward distribution.
+    :param producer: The profile of the dpos node, see getProducers
     :return:
         _round: the index of the dpos round
         _height: the height of the last dpos reward distribution
         _amount: the amount of the dpos reward distribution
-        _txid: the hash of the reward distribution transaction
+        _txid: the hash of the reward distribution transaction, the hashes are joined by '|' if it is split
         _fee: the fee of the reward distribution transaction
 
         If there is no record, 0 is returned.
     """
-    check_file(cf.distribution_record_file)
-    _record = get_last_line(cf.distribution_record_file).split(",")
+    _file = getProducer(producer)["distribution_record_file"]
+    check_file(_file)
+    _record = get_last_line(_file).split(",")
     if len(_record) == 1:
         _round = 0
         _height = 0
@@ -289,16 +604,20 @@ def get_last_distribution_record():
     return _round, _height, _amount, _txid, _fee
 
 
-def getDposRecord(firstRound: int, lastRound: int) -> dict:
+def getDposRecord(firstRound: int, lastRound: int, producer=None) -> dict:
     """
     get the dpos records from 'dpos_record.csv'
     :param firstRound: The starting  round
     :param lastRound: The ending round
+    :param producer: The profile of the dpos node, see getProducers
     :return: A dict
         key: the round
         value: dposHeight, voteHeight and the amount of the dpos reward
     """
-    _lines = linecache.getlines(cf.dpos_record_file)[firstRound - 1:lastRound]
+    # the file may be appended since it was cached
+    _file = getProducer(producer)["dpos_record_file"]
+    linecache.checkcache(_file)
+    _lines = linecache.getlines(_file)[firstRound - 1:lastRound]
     _result = {}
     for _line in _lines:
         _record = _line.strip('\n').split(",")
@@ -307,9 +626,10 @@ def getDposRecord(firstRound: int, lastRound: int) -> dict:
     return _result
 
 
-def get_last_dpos_record():
+def get_last_dpos_record(producer=None):
     """
     read the last dpos record from 'dpos_record.csv' and return
+    :param producer: The profile of the dpos node, see getProducers
     :return:
         the count of round
         the height of the last dpos reward
@@ -317,107 +637,261 @@ def get_last_dpos_record():
 
         If the program doesn't be run before, the return will be '0,0,0'
     """
-    check_file(cf.dpos_record_file)
-    _record = get_last_line(cf.dpos_record_file).split(",")
+    _file = getProducer(producer)["dpos_record_file"]
+    check_file(_file)
+    _record = get_last_line(_file).split(",")
     if len(_record) == 1:
         return 0, 0, 0
     else:
         return int(_record[0]), int(_record[1]), int(_record[2])
 
 
-def update_dpos_record(currentHeight: int):
+def nextDposRound(state: dict, hei: int):
+    """
+    move the scanner state to the dpos reward found at the specified height
+    :param state: the scanner state, see get_scan_state
+    :param hei: the height of the block which contains the dpos reward
+    :return: None
+    """
+    _lastHeight = state["dposHeight"]
+    state["round"] += 1
+    if hei - _lastHeight < 36:
+        # If the interval between hei(the height being checked) and _lastHeight(last dpos reward height
+        # in the record) is less than 36, then ForceChange is triggered.
+        state["voteHeight"] = _lastHeight - 36 - 1
+        # If ForceChange is triggered, the height of the votie is the previous one of the dpos reward height.
+        state["forceChange"] = True
+        feedback(content=f"There is a ForceChange at {hei}", level=WARNING)
+    elif hei - _lastHeight == 36 and state["forceChange"]:
+        # There is a normal dpos round after the ForceChange and the height of the vote is the same as
+        # previous round.
+        state["voteHeight"] = _lastHeight - 1
+        # Restore the ForceChange flag to false
+        state["forceChange"] = False
+        feedback(content=f"Restore the ForceChange flag to False at {hei}", level=WARNING)
+    elif hei - _lastHeight == 36:
+        # This is the normal dpos round.
+        state["voteHeight"] = hei - 73
+    else:
+        # There are some dirty data on the chain that there are more than 36 blocks without dpos reward.
+        feedback(content="There is more than 36 blocks with no dpos reward!", level=ERROR)
+        state["voteHeight"] = hei - 73
+    state["dposHeight"] = hei
+    state["height"] = hei
+
+
+def get_scan_state(round: int, dposHeight: int, voteHeight: int, producer=None) -> dict:
+    """
+    read the scanner state from the checkpoint file and check it with the last dpos record
+    :param round: the round of the last dpos record
+    :param dposHeight: the height of the last dpos record
+    :param voteHeight: the vote height of the last dpos record
+    :param producer: the profile of the dpos node, see getProducers
+    :return: A dict
+        height: the last height which has been checked
+        round, dposHeight, voteHeight: the last dpos record
+        forceChange: the ForceChange flag
+
+        If the checkpoint doesn't match the dpos record, the scan restarts from the last dpos record.
+    """
+    _record = {"round": round, "dposHeight": dposHeight, "voteHeight": voteHeight}
+    _default = dict(_record, height=dposHeight, forceChange=False)
+    _file = getProducer(producer)["scan_state_file"]
+    if not os.path.exists(_file):
+        return _default
+    try:
+        with open(_file, "r") as f_in:
+            state = json.load(f_in)
+        if state["round"] == round - 1 and state["height"] < dposHeight:
+            # The program stopped after the dpos record was written and before the checkpoint was updated.
+            nextDposRound(state, dposHeight)
+        if {key: state[key] for key in _record} == _record and state["height"] >= dposHeight:
+            feedback(content=f"Resume the scan from height[{state['height']}]")
+            return state
+    except (ValueError, KeyError, TypeError) as e:
+        feedback(content=f"The scan checkpoint is broken: {e}", level=WARNING)
+    feedback(content="The scan checkpoint doesn't match the dpos record, it is ignored.", level=WARNING)
+    return _default
+
+
+def write_scan_state(state: dict, producer=None):
+    """
+    Write the scanner state to the checkpoint file atomically.
+    :param state: the scanner state, see get_scan_state
+    :param producer: the profile of the dpos node, see getProducers
+    :return: None
+    """
+    _file = getProducer(producer)["scan_state_file"]
+    _tmpFile = f"{_file}.tmp"
+    with open(_tmpFile, "w") as f_out:
+        json.dump(state, f_out)
+        f_out.flush()
+        os.fsync(f_out.fileno())
+    os.replace(_tmpFile, _file)
+
+
+def update_dpos_record(currentHeight: int, state=None, producer=None) -> dict:
     """
     write the new dpos reward records to the 'dpos_record.csv'
     :param currentHeight: The height of the best block
-    :return: None
+    :param state: The scanner state kept by the caller, it is read from the checkpoint if it is None
+    :param producer: The profile of the dpos node, see getProducers
+    :return: The scanner state, see get_scan_state
     """
+    producer = getProducer(producer)
+    states = update_dpos_records(currentHeight, states={producer["name"]: state}, producers=[producer])
+    return states[producer["name"]]
+
 
+def update_dpos_records(currentHeight: int, states=None, producers=None) -> dict:
+    """
+    write the new dpos reward records of all dpos nodes, the blocks are scanned once for all of them
+    :param currentHeight: The height of the best block
+    :param states: The scanner states kept by the caller, keyed by the name of the dpos node. The states which are
+        not given are read from the checkpoints.
+    :param producers: The profiles of the dpos nodes, see getProducers
+    :return: The scanner states keyed by the name of the dpos node, see get_scan_state
+    """
+    producers = getProducers() if producers is None else producers
+    states = {} if states is None else dict(states)
+    _scanners = []
+    for _producer in producers:
+        _state = states.get(_producer["name"])
+        if _state is None:
+            _state = load_scan_state(_producer)
+            states[_producer["name"]] = _state
+        if currentHeight - _state["dposHeight"] < 36:
+            feedback(content="Less than 36 blocks from last dpos height, no dpos record needs to be updates.")
+        else:
+            _scanners.append((_producer, _state))
+
+    if len(_scanners) > 0:
+        feedback(content="Start to update dpos record")
+        if cf.dpos_probe_scan:
+            for _producer, _state in _scanners:
+                probeDposRecord(_producer, _state, currentHeight)
+        else:
+            scanDposRecord(_scanners, min(_state["height"] for _, _state in _scanners) + 1, currentHeight)
+        for _producer, _state in _scanners:
+            write_scan_state(_state, _producer)
+    return states
+
+
+def load_scan_state(producer: dict) -> dict:
+    """
+    read the scanner state of the dpos node, the first two dpos records are added if there is no record
+    :param producer: The profile of the dpos node, see getProducers
+    :return: The scanner state, see get_scan_state
+    """
     # get the last dpos reward record from 'dpos_record.csv'
-    _round, _lastDposHeight, _lastVoteHeight = get_last_dpos_record()
+    _round, _lastDposHeight, _lastVoteHeight = get_last_dpos_record(producer)
 
     if _round == 0 and _lastDposHeight == 0 and _lastVoteHeight == 0:
         feedback(content="No dpos record is found, the first two records will be added manully")
+        _add = producer["dposRewardAddress"]
         # write_dpos_record("round", "dposHeight", "voteHeight", "reward")
-        write_dpos_record(1, cf.H2 + 36, cf.H2 - 361, getDposRewardByHeight(hei=cf.H2 + 36))
-        write_dpos_record(2, cf.H2 + 72, cf.H2 - 1, getDposRewardByHeight(hei=cf.H2 + 72))
-        _round, _lastDposHeight, _lastVoteHeight = get_last_dpos_record()
+        write_dpos_record(1, cf.H2 + 36, cf.H2 - 361, getDposRewardByHeight(hei=cf.H2 + 36, add=_add), producer)
+        write_dpos_record(2, cf.H2 + 72, cf.H2 - 1, getDposRewardByHeight(hei=cf.H2 + 72, add=_add), producer)
+        _round, _lastDposHeight, _lastVoteHeight = get_last_dpos_record(producer)
+    return get_scan_state(_round, _lastDposHeight, _lastVoteHeight, producer)
 
-    if currentHeight - _lastDposHeight < 36:
-        feedback(content="Less than 36 blocks from last dpos height, no dpos record needs to be updates.")
-        return
-    else:
-        feedback(content="Start to update dpos record")
-        _lastHeight = _lastDposHeight
-        _lastVote = _lastVoteHeight
-        _forceChangeState = False
-        for _hei in range(_lastDposHeight + 1, currentHeight):
-            # check each block after the last dpos height to find the dpos reward output
-            _vouts = getCoinbaseOutput(_hei)
-            if len(_vouts) < 3:
-                # If the outputs contains dpos reward, the number of outputs must not be less than 3.
-                continue
-            else:
-                feedback(content=f"Check Block[{_hei}]'s output")
-                if _hei - _lastHeight < 36:
-                    # If the interval between _hei(the height being checked) and  _lastHeight(last dpos reward height
-                    # in the record) is less than 36, then ForceChange is triggered.
-                    _round += 1
-                    _reward = getDposRewardByHeight(hei=_hei)
-                    _lastVote = _lastHeight - 36 - 1
-                    _lastHeight = _hei
-                    # If ForceChange is triggered, the height of the votie is the previous one of the dpos reward height.
-                    _forceChangeState = True
-                    write_dpos_record(_round, _lastHeight, _lastVote, _reward)
-                    feedback(content=f"There is a ForceChange at {_hei}", level=WARNING)
-
-                elif _hei - _lastHeight == 36 and _forceChangeState:
-                    # There is a normal dpos round after the ForceChange and the height of the vote is the same as
-                    # previous round.
-                    _round += 1
-                    _reward = getDposRewardByHeight(hei=_hei)
-                    _lastVote = _lastHeight - 1
-                    _lastHeight = _hei
-                    write_dpos_record(_round, _lastHeight, _lastVote, _reward)
-                    # Restore the ForceChange flag to false
-                    _forceChangeState = False
-                    feedback(content=f"Restore the ForceChange flag to False at {_hei}", level=WARNING)
-
-                elif _hei - _lastHeight == 36:
-                    # This is the normal dpos round.
-                    _round += 1
-                    _reward = getDposRewardByHeight(hei=_hei)
-                    _lastVote = _hei - 73
-                    _lastHeight = _hei
-                    write_dpos_record(_round, _lastHeight, _lastVote, _reward)
+
+def scanDposRecord(scanners: list, firstHeight: int, lastHeight: int, stopAtReward=False) -> bool:
+    """
+    check each block from firstHeight to lastHeight (not included) to find the dpos reward output, and write the
+    dpos records found to the 'dpos_record.csv'
+    :param scanners: the profiles and the scanner states of the dpos nodes, see get_scan_state. The blocks which
+        have been checked by a node are skipped for it.
+    :param firstHeight: the first height to be checked
+    :param lastHeight: the height where the scan stops, it is not included
+    :param stopAtReward: stop the scan at the first dpos reward
+    :return: True if the scan stopped at a dpos reward
+    """
+    _checkpoints = [_state["height"] for _, _state in scanners]
+    with closing(iterCoinbaseOutput(firstHeight, lastHeight)) as _blocks:
+        for _hei, _vouts in _blocks:
+            _found = False
+            for _i, (_producer, _state) in enumerate(scanners):
+                if _hei <= _state["height"]:
+                    continue
+                _state["height"] = _hei
+                if len(_vouts) < 3:
+                    # If the outputs contains dpos reward, the number of outputs must not be less than 3.
+                    if _hei - _checkpoints[_i] >= cf.checkpoint_interval:
+                        write_scan_state(_state, _producer)
+                        _checkpoints[_i] = _hei
+                    continue
                 else:
-                    # There are some dirty data on the chain that there are more than 36 blocks without dpos reward.
-                    feedback(content="There is more than 36 blocks with no dpos reward!", level=ERROR)
-                    _round += 1
-                    _reward = getDposRewardByHeight(hei=_hei)
-                    _lastVote = _hei - 73
-                    _lastHeight = _hei
-                    write_dpos_record(_round, _lastHeight, _lastVote, _reward)
+                    feedback(content=f"Check Block[{_hei}]'s output")
+                    writeDposRound(_producer, _state, _hei, _vouts)
+                    _checkpoints[_i] = _hei
+                    _found = True
+            if _found and stopAtReward:
+                return True
+    return False
+
 
+def probeDposRecord(producer: dict, state: dict, currentHeight: int):
+    """
+    jump to the height where the next dpos reward is expected and check it only. If the prediction fails, the blocks
+    after the last checked height are scanned until the next dpos reward is found.
+    :param producer: the profile of the dpos node, see getProducers
+    :param state: the scanner state, see get_scan_state
+    :param currentHeight: The height of the best block
+    :return: None
+    """
+    while True:
+        _expected = state["dposHeight"] + 36
+        if _expected >= currentHeight:
+            # The next dpos round has not ended, but a ForceChange may happen in the remaining blocks.
+            scanDposRecord([(producer, state)], state["height"] + 1, currentHeight)
+            return
+        _vouts = getCoinbaseOutput(_expected)
+        if len(_vouts) >= 3:
+            feedback(content=f"Check Block[{_expected}]'s output")
+            writeDposRound(producer, state, _expected, _vouts)
+        else:
+            feedback(content=f"There is no dpos reward at the expected height[{_expected}], scan the gap.",
+                     level=WARNING)
+            if not scanDposRecord([(producer, state)], state["height"] + 1, currentHeight, stopAtReward=True):
+                return
+
+
+def writeDposRound(producer: dict, state: dict, hei: int, vouts: list):
+    """
+    write the dpos record at the specified height and save the scanner state
+    :param producer: the profile of the dpos node, see getProducers
+    :param state: the scanner state, see get_scan_state
+    :param hei: the height of the block which contains the dpos reward
+    :param vouts: the coinbase's outputs of the block
+    :return: None
+    """
+    _reward = getDposRewardByHeight(hei=hei, add=producer["dposRewardAddress"], vouts=vouts)
+    nextDposRound(state, hei)
+    write_dpos_record(state["round"], state["dposHeight"], state["voteHeight"], _reward, producer)
+    write_scan_state(state, producer)
 
-def write_distribution_record(round: int, hei: int, amount: str, txid: str, fee: int):
+
+def write_distribution_record(round: int, hei: int, amount: str, txid: str, fee: int, producer=None):
     # 将收益分配记录写入文件，amount单位为ela，fee单位为sela
     _record = f"{round},{hei},{amount},{txid},{fee}\n"
-    write_record(cf.distribution_record_file, _record)
+    write_record(getProducer(producer)["distribution_record_file"], _record)
     feedback(
         content=f"Update DistributionRecord: Round[{round}] DposHeight[{hei} Txid[{txid}] Amount:{amount}] fee:{fee}")
 
 
-def write_dpos_record(round, dposHeight, voteHeight, reward):
+def write_dpos_record(round, dposHeight, voteHeight, reward, producer=None):
     """
     Write the record of the node dpos reward to the file.
     :param round: The index of the dpos round.
     :param dposHeight: The height of the dpos reward.
     :param voteHeight: The height of the vote
     :param reward: The amount of the specificed dpos node's reward.
+    :param producer: The profile of the dpos node, see getProducers
     :return: None
     """
     _record = f"{round},{dposHeight},{voteHeight},{reward}\n"
-    write_record(cf.dpos_record_file, _record)
+    write_record(getProducer(producer)["dpos_record_file"], _record)
     feedback(
         content=f"Update DposRecord: Round[{round}] DposHeight[{dposHeight}] VoteHeight[{voteHeight}] Reward[{reward}]")
 
@@ -469,6 +943,19 @@ def write_tx_to_file(rawtx: str, txid: str):
         feedback(content=f"txid[{txid}] is recorded.")
 
 
+def read_tx_from_file(txid: str):
+    """
+    read the data of the transaction recorded by write_tx_to_file
+    :param txid: The hash of the transaction
+    :return: The data of the transaction, None if it is not recorded
+    """
+    _files = sorted(glob.glob(f"{cf.tx_path}/*_{txid}.tx"))
+    if len(_files) == 0:
+        return None
+    with open(_files[-1], "r") as tx_f:
+        return tx_f.read().strip()
+
+
 def replace_angle_brackets(s):
     return s.replace('<', '{').replace('>', '}').replace('}\n\t{', '},\n\t{').replace('}{', '},\n\t{').replace('\n',
                                                                                                                '').replace(
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+@author: Bocheng.Zhang
+@license: MIT
+@contact: bocheng0000@gmail.com
+@file: block.py
+@time: 2019-07-22 15:08
+"""
+
+from wallet import transaction as t
+from utility import encoding
+from utility.serialize import ByteReader
+
+
+class BlockHeader:
+    def __init__(self, version: int, previous: str, merkle_root: str, timestamp: int, bits: int, nonce: int,
+                 height: int):
+        self.version = version
+        self.previous = previous
+        self.merkle_root = merkle_root
+        self.timestamp = timestamp
+        self.bits = bits
+        self.nonce = nonce
+        self.height = height
+
+    @staticmethod
+    def unserialize(data):
+        reader = ByteReader(data)
+        return BlockHeader.read(reader), reader.rest()
+
+    @staticmethod
+    def read(reader: ByteReader):
+        version = reader.read_uint32()
+        previous = encoding.bytes_to_hexstring(reader.read(32))
+        merkle_root = encoding.bytes_to_hexstring(reader.read(32))
+        timestamp = reader.read_uint32()
+        bits = reader.read_uint32()
+        nonce = reader.read_uint32()
+        height = reader.read_uint32()
+        # The aux pow of the merged mining is not used, skip it.
+        AuxPow.read(reader)
+        # The header ends with a fixed byte 0x01
+        reader.skip(1)
+        return BlockHeader(version=version, previous=previous, merkle_root=merkle_root, timestamp=timestamp,
+                           bits=bits, nonce=nonce, height=height)
+
+    def __str__(self):
+        return '<\n\tversion:{},\n\tprevious:{},\n\tmerkle root:{},\n\ttimestamp:{},\n\tbits:{},\n\tnonce:{},' \
+               '\n\theight:{},\n\t>'.format(self.version, self.previous, self.merkle_root, self.timestamp, self.bits,
+                                            self.nonce, self.height)
+
+
+class AuxPow:
+    @staticmethod
+    def skip(data):
+        """
+        Skip the aux pow in the block header.
+        :param data: The data starts with the aux pow
+        :return: The data after the aux pow
+        """
+        reader = ByteReader(data)
+        AuxPow.read(reader)
+        return reader.rest()
+
+    @staticmethod
+    def read(reader: ByteReader):
+        """
+        Skip the aux pow at the offset of the reader.
+        """
+        AuxPow.read_btc_tx(reader)
+        # The hash of the parent coinbase transaction
+        reader.skip(32)
+        # The merkle branch of the parent coinbase transaction and its index
+        reader.skip(32 * reader.read_variable_int() + 4)
+        # The merkle branch of the aux chain and its index
+        reader.skip(32 * reader.read_variable_int() + 4)
+        # The header of the parent block
+        reader.skip(80)
+
+    @staticmethod
+    def skip_btc_tx(data):
+        """
+        Skip the coinbase transaction of the parent block.
+        :param data: The data starts with the transaction
+        :return: The data after the transaction
+        """
+        reader = ByteReader(data)
+        AuxPow.read_btc_tx(reader)
+        return reader.rest()
+
+    @staticmethod
+    def read_btc_tx(reader: ByteReader):
+        """
+        Skip the coinbase transaction of the parent block at the offset of the reader.
+        """
+        reader.skip(4)
+        count_inputs = reader.read_variable_int()
+        for i in range(count_inputs):
+            reader.skip(36)
+            reader.skip_bytes()
+            reader.skip(4)
+        count_outputs = reader.read_variable_int()
+        for i in range(count_outputs):
+            reader.skip(8)
+            reader.skip_bytes()
+        reader.skip(4)
+
+
+class Block:
+    @staticmethod
+    def unserialize_coinbase(data):
+        """
+        Decode the header and the first transaction of the block only.
+        :param data: The raw data of the block
+        :return: The block header and the coinbase transaction
+        """
+        reader = ByteReader(data)
+        header = BlockHeader.read(reader)
+        count_txs = reader.read_uint32()
+        if count_txs == 0:
+            raise ValueError('There is no transaction in the block.')
+        coinbase = t.Transaction.read(reader)
+        if coinbase.tx_type != t.COINBASE:
+            raise ValueError('The first transaction of the block is not coinbase.')
+        return header, coinbase
@@ -12,7 +12,7 @@
 import struct
 
 from wallet import transaction as t
-from utility.serialize import Serialize
+from utility.serialize import Serialize, ByteReader
 
 
 class Payload:
@@ -26,20 +26,26 @@ class Payload:
 
     @staticmethod
     def unserialize(data, tx_type, payload_version=0):
+        reader = ByteReader(data)
+        return Payload.read(reader, tx_type, payload_version), reader.rest()
+
+    @staticmethod
+    def read(reader: ByteReader, tx_type, payload_version=0):
         if tx_type == t.COINBASE:
-            return PayloadCoinBase.unserialize(data=data)
+            return PayloadCoinBase.read(reader)
         elif tx_type == t.REGISTERASSET:
-            return PayloadRegisterAsset.unserialize(data=data)
+            return PayloadRegisterAsset.read(reader)
         elif tx_type == t.TRANSFERASSET:
-            return PayloadTransferMainchain.unserialize(data=data)
+            return PayloadTransferMainchain.read(reader)
         # elif tx_type == t.RECORD:
-        #     return PayloadRecord.unserialize(data=data)
+        #     return PayloadRecord.read(reader)
         # elif tx_type == t.SIDECHAINPOW:
-        #     return PayloadSidechainPOW.unserialize(data=data)
+        #     return PayloadSidechainPOW.read(reader)
         # elif tx_type == t.WITHDRAWFROMSIDECHAIN:
-        #     return PayloadWithDrawFromSidechain.unserialize(data=data)
+        #     return PayloadWithDrawFromSidechain.read(reader)
         # elif tx_type == t.TRANSFERCROSSCHAINASSET:
-        #     return PayloadTransferCrosschainAsset.unserialize(data=data)
+        #     return PayloadTransferCrosschainAsset.read(reader)
+        raise ValueError(f"unsupported tx type {tx_type}")
 
     @staticmethod
     def __str__(pl):
@@ -59,9 +65,12 @@ class PayloadCoinBase:
 
     @staticmethod
     def unserialize(data):
-        payload, data = Serialize.unserialize_bytes(data)
-        coinbase_payload = PayloadCoinBase(payload=payload)
-        return coinbase_payload, data
+        reader = ByteReader(data)
+        return PayloadCoinBase.read(reader), reader.rest()
+
+    @staticmethod
+    def read(reader: ByteReader):
+        return PayloadCoinBase(payload=reader.read_bytes())
 
     def __str__(self):
         return self.payload.decode()
@@ -96,24 +105,29 @@ class PayloadRegisterAsset:
 
     @staticmethod
     def unserialize(data: bytes):
-        name, data = Serialize.unserialize_bytes(data)
-        description, data = Serialize.unserialize_bytes(data)
+        reader = ByteReader(data)
+        return PayloadRegisterAsset.read(reader), reader.rest()
 
-        precision = data[0]
+    @staticmethod
+    def read(reader: ByteReader):
+        name = reader.read_bytes()
+        description = reader.read_bytes()
+
+        precision = reader.read_uint8()
         # if precision <= b'0x00':
         if precision <= 0:
             raise ValueError('Precision is less than 0.')
-        asset_type = data[1]
+        asset_type = reader.read_uint8()
         # if asset_type <= b'0x00':
         if asset_type not in [0, 1]:
             raise ValueError('Asset type is less than 0.')
-        record_type = data[2]
-        value = struct.unpack("<Q", data[3:11])[0]
-        controller = data[11:32]
+        record_type = reader.read_uint8()
+        value = reader.read_uint64()
+        controller = reader.read(21)
         registerAssetPayload = PayloadRegisterAsset(name=name, description=description, precision=precision,
                                                     asset_type=asset_type, record_type=record_type, value=value,
                                                     controller=controller)
-        return registerAssetPayload, data[32:]
+        return registerAssetPayload
 
     def __str__(self):
         return '<\n\tname:{},\n\tdescription:{},\n\tprecission:{},\n\tasset type:{},\n\trecord type:{},\n\tvalue:{},\n\tcontroller:{},\n\t>'.format(
@@ -135,5 +149,9 @@ class PayloadTransferMainchain:
     def unserialize(data):
         return PayloadTransferMainchain(), data
 
+    @staticmethod
+    def read(reader: ByteReader):
+        return PayloadTransferMainchain()
+
     def __str__(self):
         return ""
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+@author: Bocheng.Zhang
+@license: MIT
+@contact: bocheng0000@gmail.com
+@file: signer.py
+@time: 2019-08-08 14:20
+"""
+
+import hashlib
+import struct
+import threading
+import time
+
+from ecdsa import rfc6979
+from ecdsa.ecdsa import Public_key, Signature
+from ecdsa.ellipticcurve import PointJacobi
+from ecdsa.numbertheory import inverse_mod
+
+import config as cf
+from utility.secp256r1 import secp256r1_curve as curve, secp256r1_n as secp_n, secp256r1_p as secp_p, \
+    secp256r1_a, secp256r1_b, secp256r1_Gx, secp256r1_Gy
+
+try:
+    from cryptography.exceptions import InvalidSignature, UnsupportedAlgorithm
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, utils
+except ImportError:
+    ec = None
+
+# The generator with the precomputed multiples, shared by all signers
+generator = PointJacobi(curve, secp256r1_Gx, secp256r1_Gy, 1, secp_n, generator=True)
+
+
+class PythonBackend:
+    """
+    The pure python implementation with the ecdsa package, it is always available.
+    """
+    name = "python"
+
+    def load_private_key(self, secret: int):
+        return secret
+
+    def public_key(self, key) -> bytes:
+        _point = generator * key
+        _prefix = b"\x03" if _point.y() & 1 else b"\x02"
+        return _prefix + _point.x().to_bytes(32, byteorder="big")
+
+    def sign_digest(self, key, digest: bytes):
+        """
+        :return: r and s of the signature, the nonce is generated by RFC 6979
+        """
+        e = int.from_bytes(digest, byteorder="big", signed=False)
+        _retry = 0
+        while True:
+            k = rfc6979.generate_k(secp_n, key, hashlib.sha256, digest, retry_gen=_retry)
+            r = (generator * k).x() % secp_n
+            s = inverse_mod(k, secp_n) * (e + key * r) % secp_n
+            if r != 0 and s != 0:
+                return r, s
+            _retry += 1
+
+    def verify_digest(self, public_key: bytes, digest: bytes, r: int, s: int) -> bool:
+        _point = decompress_point(public_key)
+        if _point is None:
+            return False
+        e = int.from_bytes(digest, byteorder="big", signed=False)
+        return Public_key(generator, _point, verify=False).verifies(e, Signature(r, s))
+
+
+class OpenSSLBackend:
+    """
+    The implementation with OpenSSL through the cryptography package. The nonces are generated by RFC 6979 if the
+    OpenSSL supports it, else they are random.
+    """
+    name = "openssl"
+
+    def __init__(self):
+        self._prehashed = ec.ECDSA(utils.Prehashed(hashes.SHA256()))
+        self._algorithm = self._prehashed
+        try:
+            _algorithm = ec.ECDSA(utils.Prehashed(hashes.SHA256()), deterministic_signing=True)
+            ec.derive_private_key(1, ec.SECP256R1()).sign(bytes(32), _algorithm)
+            self._algorithm = _algorithm
+        except (TypeError, UnsupportedAlgorithm):
+            pass
+
+    def load_private_key(self, secret: int):
+        return ec.derive_private_key(secret, ec.SECP256R1())
+
+    def public_key(self, key) -> bytes:
+        return key.public_key().public_bytes(serialization.Encoding.X962, serialization.PublicFormat.CompressedPoint)
+
+    def sign_digest(self, key, digest: bytes):
+        return utils.decode_dss_signature(key.sign(digest, self._algorithm))
+
+    def verify_digest(self, public_key: bytes, digest: bytes, r: int, s: int) -> bool:
+        try:
+            _key = ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(), public_key)
+            _key.verify(utils.encode_dss_signature(r, s), digest, self._prehashed)
+            return True
+        except (ValueError, InvalidSignature):
+            return False
+
+
+def decompress_point(public_key: bytes):
+    """
+    Get the point of the public key.
+    :param public_key: The compressed public key, or the uncompressed one starts with 0x04
+    :return: The point, None if the public key is invalid
+    """
+    if len(public_key) == 33 and public_key[0] in (2, 3):
+        x = int.from_bytes(public_key[1:], byteorder="big")
+        # p % 4 == 3, so the square root is the power of (p + 1) / 4
+        y = pow((pow(x, 3, secp_p) + secp256r1_a * x + secp256r1_b) % secp_p, (secp_p + 1) // 4, secp_p)
+        if y & 1 != public_key[0] & 1:
+            y = secp_p - y
+    elif len(public_key) == 65 and public_key[0] == 4:
+        x = int.from_bytes(public_key[1:33], byteorder="big")
+        y = int.from_bytes(public_key[33:], byteorder="big")
+    else:
+        return None
+    if x >= secp_p or not curve.contains_point(x, y):
+        return None
+    return PointJacobi(curve, x, y, 1, secp_n)
+
+
+def available_backends() -> list:
+    backends = [PythonBackend()]
+    if ec is not None:
+        backends.insert(0, OpenSSLBackend())
+    return backends
+
+
+_backend = None
+
+
+def get_backend():
+    """
+    return the backend selected by 'crypto_backend' in config, 'auto' selects OpenSSL if the cryptography package is
+    installed, else the pure python one.
+    """
+    global _backend
+    if _backend is None:
+        _backends = {_b.name: _b for _b in available_backends()}
+        if cf.crypto_backend == "auto":
+            _backend = _backends.get(OpenSSLBackend.name, _backends[PythonBackend.name])
+        elif cf.crypto_backend in _backends.keys():
+            _backend = _backends[cf.crypto_backend]
+        else:
+            raise ValueError(f"The crypto backend {cf.crypto_backend} is not available.")
+    return _backend
+
+
+class Signer:
+    """
+    Sign with a private key loaded once. The nonces are generated by RFC 6979, so the same data is always signed
+    to the same signature.
+    """
+
+    def __init__(self, private_key: str, backend=None):
+        """
+        :param private_key: The private key in hex
+        :param backend: The crypto backend, see get_backend
+        """
+        _secret = int.from_bytes(bytes.fromhex(private_key), byteorder="big", signed=False)
+        if not 0 < _secret < secp_n:
+            raise ValueError("The private key is out of range.")
+        self._backend = get_backend() if backend is None else backend
+        self._key = self._backend.load_private_key(_secret)
+        self._public_key = None
+
+    def public_key(self) -> str:
+        """
+        :return: The compressed public key in hex, it is calculated at the first call
+        """
+        if self._public_key is None:
+            self._public_key = self._backend.public_key(self._key).hex()
+        return self._public_key
+
+    def sign(self, data) -> bytes:
+        """
+        Sign the sha256 of the data.
+        :param data: The data to sign, in bytes or hex
+        :return: The signature, the length of r and s, then r and s
+        """
+        if isinstance(data, str):
+            data = bytes.fromhex(data)
+        return self.sign_digest(hashlib.sha256(data).digest())
+
+    def sign_digest(self, digest: bytes) -> bytes:
+        """
+        Sign the digest of the data.
+        :param digest: The sha256 of the data
+        :return: The signature, see sign
+        """
+        r, s = self._backend.sign_digest(self._key, digest)
+        _signature = r.to_bytes(32, byteorder="big", signed=False) + s.to_bytes(32, byteorder="big", signed=False)
+        return struct.pack("B", len(_signature)) + _signature
+
+    def sign_batch(self, datas: list) -> list:
+        """
+        Sign the sha256 of each data.
+        :param datas: The data to sign, see sign
+        :return: The signatures in the same order
+        """
+        return [self.sign(_data) for _data in datas]
+
+
+def verify(public_key: str, data, signature: bytes, backend=None) -> bool:
+    """
+    Verify the signature of the sha256 of the data.
+    :param public_key: The public key in hex
+    :param data: The signed data, in bytes or hex
+    :param signature: The signature, r and s with or without the length prefix, see Signer.sign
+    :param backend: The crypto backend, see get_backend
+    :return: True if the signature is valid
+    """
+    if isinstance(data, str):
+        data = bytes.fromhex(data)
+    if len(signature) == 65 and signature[0] == 64:
+        signature = signature[1:]
+    if len(signature) != 64:
+        return False
+    r = int.from_bytes(signature[:32], byteorder="big", signed=False)
+    s = int.from_bytes(signature[32:], byteorder="big", signed=False)
+    if not (0 < r < secp_n and 0 < s < secp_n):
+        return False
+    _backend = get_backend() if backend is None else backend
+    return _backend.verify_digest(bytes.fromhex(public_key), hashlib.sha256(data).digest(), r, s)
+
+
+_signers = {}
+_signers_lock = threading.Lock()
+
+
+def get_signer(private_key: str) -> Signer:
+    """
+    return the signer of the private key, it is created at the first call
+    """
+    _signer = _signers.get(private_key)
+    if _signer is None:
+        with _signers_lock:
+            _signer = _signers.get(private_key)
+            if _signer is None:
+                _signer = Signer(private_key)
+                _signers[private_key] = _signer
+    return _signer
+
+
+if __name__ == '__main__':
+    # Benchmark the backends, and check the signatures of each backend with the others
+    _count = 200
+    _privateKey = hashlib.sha256(b"benchmark").hexdigest()
+    _datas = [hashlib.sha256(i.to_bytes(4, byteorder="big")).digest() * 8 for i in range(_count)]
+    _results = {}
+    for _b in available_backends():
+        _signer = Signer(_privateKey, backend=_b)
+        _start = time.time()
+        _signatures = _signer.sign_batch(_datas)
+        _elapsed = time.time() - _start
+        _results[_b.name] = (_elapsed, _signer.public_key(), _signatures)
+        print(f"{_b.name}: {_count} signatures in {_elapsed:.3f}s, {_elapsed / _count * 1000:.3f}ms per signature")
+    for _name, (_, _publicKey, _signatures) in _results.items():
+        for _b in available_backends():
+            _valid = all(verify(_publicKey, _data, _signature, backend=_b) for _data, _signature in
+                         zip(_datas, _signatures))
+            print(f"The signatures of {_name} are verified by {_b.name}: {_valid}")
+    if len(_results) > 1:
+        print(f"Speedup: {_results[PythonBackend.name][0] / _results[OpenSSLBackend.name][0]:.1f}x")
@@ -9,18 +9,29 @@
 @time: 2019-07-04 14:44
 """
 # import binascii
-import ecdsa
-import hashlib
-import random
 import struct
 
 from wallet import payload as p
+from wallet import signer
 from utility import encoding, util
-from utility.serialize import Serialize
-from utility.secp256r1 import secp256r1_generator as generator, secp256r1_curve as curve, secp256r1_p as secp_p, \
-    secp256r1_n as secp_n
+from utility.serialize import Serialize, ByteReader
 
 ELA_ASSETID = "a3d0eaa466df74983b5d7c543de6904f4c9418ead5ffd6d25814234a96db37b0"
+ELA_ASSETID_BYTES = bytes.fromhex(ELA_ASSETID)[::-1]
+
+# The layouts of the fixed size fields
+_uint8 = struct.Struct("B")
+_uint32 = struct.Struct("<L")
+_input_layout = struct.Struct("<32sHL")
+_output_layout = struct.Struct("<32sQL21s")
+_output_layout_v09 = struct.Struct("<32sQL21sB")
+
+# Transaction Version
+TxVersionDefault = 0x00
+TxVersion09 = 0x09
+
+# Output Type, only used since TxVersion09
+OTNone = 0x00
 
 
 class TxInput:
@@ -33,11 +44,8 @@ class TxInput:
         return self.sequence == 0xffffffff
 
     def serialize(self):
-        data_list = []
-        data_list.append(encoding.hexstring_to_bytes(self.txid))
-        data_list.append(struct.pack("<H", self.index))
-        data_list.append(struct.pack("<L", self.sequence))
-        return b''.join(data_list)
+        # The txid is in reversed byte order
+        return _input_layout.pack(bytes.fromhex(self.txid)[::-1], self.index, self.sequence)
 
     @staticmethod
     def serialize_size():
@@ -45,11 +53,15 @@ class TxInput:
 
     @staticmethod
     def unserialize(data):
-        txid = data[:32]
-        index = struct.unpack("<H", data[32:34])[0]
-        sequence = struct.unpack("<L", data[34:38])[0]
-        tx_input = TxInput(txid=txid, index=index, sequence=sequence)
-        return tx_input, data[38:]
+        reader = ByteReader(data)
+        return TxInput.read(reader), reader.rest()
+
+    @staticmethod
+    def read(reader: ByteReader):
+        txid = encoding.bytes_to_hexstring(reader.read(32))
+        index = reader.read_uint16()
+        sequence = reader.read_uint32()
+        return TxInput(txid=txid, index=index, sequence=sequence)
 
     def __str__(self):
         return '<\n\ttxid:{},\n\tindex={:04x},\n\tsequence={},\n\t>'.format(self.txid, self.index,
@@ -57,7 +69,7 @@ class TxInput:
 
 
 class TxOutput:
-    def __init__(self, value: int, outputLock=0, address="", programHash="", assetID=ELA_ASSETID):
+    def __init__(self, value: int, outputLock=0, address="", programHash="", assetID=ELA_ASSETID, outputType=OTNone):
         assert value >= 0
         assert len(address) == 34 or len(programHash) == 42
         self.assetID = assetID
@@ -66,27 +78,43 @@ class TxOutput:
         if len(programHash) == 0:
             programHash = encoding.address_to_programhash(address)
         self.programHash = programHash
+        self.outputType = outputType
 
-    def serialize(self):
-        data_list = []
-        data_list.append(encoding.hexstring_to_bytes(self.assetID))
-        data_list.append(struct.pack("<Q", self.value))
-        data_list.append(struct.pack("<L", self.outputLock))
-        data_list.append(encoding.hexstring_to_bytes(self.programHash, reverse=False))
-        return b''.join(data_list)
+    def serialize(self, tx_version=TxVersionDefault):
+        _assetID = ELA_ASSETID_BYTES if self.assetID == ELA_ASSETID else encoding.hexstring_to_bytes(self.assetID)
+        if tx_version >= TxVersion09:
+            # The payload of OTNone is empty
+            return _output_layout_v09.pack(_assetID, self.value, self.outputLock, bytes.fromhex(self.programHash),
+                                           self.outputType)
+        return _output_layout.pack(_assetID, self.value, self.outputLock, bytes.fromhex(self.programHash))
 
     @staticmethod
-    def serialize_size():
+    def serialize_size(tx_version=TxVersionDefault):
+        if tx_version >= TxVersion09:
+            return 66
         return 65
 
     @staticmethod
-    def unserialize(data):
-        asset_id = encoding.bytes_to_hexstring(data[:32])
-        value = struct.unpack("<Q", data[32:40])[0]
-        output_lock = struct.unpack("<L", data[40:44])[0]
-        program_hash = data[44:65].decode()
-        tx_output = TxOutput(assetID=asset_id, value=value, outputLock=output_lock, programHash=program_hash)
-        return tx_output, data[65:]
+    def unserialize(data, tx_version=TxVersionDefault):
+        reader = ByteReader(data)
+        return TxOutput.read(reader, tx_version), reader.rest()
+
+    @staticmethod
+    def read(reader: ByteReader, tx_version=TxVersionDefault):
+        asset_id = encoding.bytes_to_hexstring(reader.read(32))
+        value = reader.read_uint64()
+        output_lock = reader.read_uint32()
+        program_hash = reader.read(21).hex()
+        output_type = OTNone
+        if tx_version >= TxVersion09:
+            output_type = reader.read_uint8()
+            if output_type != OTNone:
+                raise ValueError('Output type {} is not supported.'.format(output_type))
+        return TxOutput(assetID=asset_id, value=value, outputLock=output_lock, programHash=program_hash,
+                        outputType=output_type)
+
+    def address(self):
+        return encoding.programhash_to_address(self.programHash)
 
     def __str__(self):
         return '<\n\tassetID:{},\n\tvalue:{},\n\toutputLock:{},\n\tprogramHash:{},\n\t>'.format(
@@ -130,12 +158,15 @@ class Attribute:
 
     @staticmethod
     def unserialize(data):
-        usage = data[0]
+        reader = ByteReader(data)
+        return Attribute.read(reader), reader.rest()
+
+    @staticmethod
+    def read(reader: ByteReader):
+        usage = reader.read_uint8()
         if not isValidAttribute(usage):
             raise ValueError('Attribute is invalid.')
-        attribute_data, data = Serialize.unserialize_bytes(data[1:])
-        attribute = Attribute(usage=usage, data=attribute_data)
-        return attribute, data
+        return Attribute(usage=usage, data=reader.read_bytes())
 
     def __str__(self):
         return '<\n\t\tusage:{},\n\t\tdata:{},\n\t>'.format(self.usage, self.data.hex())
@@ -153,19 +184,22 @@ class Program:
         return b''.join(data_list)
 
     def serialize_size(self):
-        len_parameter = len(self.parameter)
-        len_code = len(self.code)
+        # The parameter and the code are in hex
+        len_parameter = len(self.parameter) // 2
+        len_code = len(self.code) // 2
         return Serialize.serialize_variable_int_size(len_parameter) + len_parameter + \
                Serialize.serialize_variable_int_size(len_code) + len_code
 
     @staticmethod
     def unserialize(data):
-        len_parameter, data = Serialize.unserialize_variable_int(data)
-        parameter = data[:len_parameter]
-        len_code, data = Serialize.unserialize_variable_int(data[len_parameter:])
-        code = data[:len_code]
-        program = Program(parameter=parameter.hex(), code=code.hex())
-        return program, data[len_code:]
+        reader = ByteReader(data)
+        return Program.read(reader), reader.rest()
+
+    @staticmethod
+    def read(reader: ByteReader):
+        parameter = reader.read_bytes()
+        code = reader.read_bytes()
+        return Program(parameter=parameter.hex(), code=code.hex())
 
     def __str__(self):
         return 'parameter:{},\n\tcode:{}\n'.format(self.parameter.hex(), self.code.hex())
@@ -197,8 +231,15 @@ UpdateVersion = 0x13
 
 
 class Transaction:
+    """
+    The serialization without programs and the hash are cached, and dropped when a field is assigned or an element
+    of attributes, inputs and outputs is added, removed or replaced. Call invalidate() after modifying an element in
+    place.
+    """
+
     def __init__(self, tx_type=TRANSFERASSET, payload_version=0x00, payload=None, attributes=[], inputs=[], outputs=[],
-                 lock_time=0, programs=[]):
+                 lock_time=0, programs=[], version=TxVersionDefault):
+        self.version = version
         self.tx_type = tx_type
         self.payload_version = payload_version
         self.payload = p.PayloadTransferMainchain() if payload is None else payload
@@ -208,12 +249,28 @@ class Transaction:
         self.lock_time = lock_time
         self.programs = [] if programs is None else programs
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        # The programs are not in the unsigned data
+        if name != "programs" and name != "_cache":
+            object.__setattr__(self, "_cache", None)
+
+    def invalidate(self):
+        self._cache = None
+
+    def _cache_key(self):
+        return tuple(map(id, self.attributes)), tuple(map(id, self.inputs)), tuple(map(id, self.outputs))
+
     def hash(self):
         data = self.serialize_unsigned()
-        return encoding.double_sha256(data)
+        _key, _data, _hash = self._cache
+        if _hash is None:
+            _hash = encoding.double_sha256(data)
+            self._cache = (_key, _data, _hash)
+        return _hash
 
     def is_coinbase(self):
-        return len(self.inputs) == 1 and self.inputs[0].txid == (b'\x00' * 32) and self.inputs[
+        return len(self.inputs) == 1 and self.inputs[0].txid == ('00' * 32) and self.inputs[
             0].index == 0xffff and self.inputs[0].sequence == 0xffffffff
 
     # Todo: test check function
@@ -226,10 +283,28 @@ class Transaction:
                 result.append(program.check())
             return all(result)
 
+    def verify_signature(self, public_key: str) -> bool:
+        """
+        Check that the transaction is signed by the public key.
+        :param public_key: The public key in hex
+        :return: True if the program is the public key's and its signature is valid
+        """
+        if len(self.programs) != 1 or self.programs[0].code != encoding.get_code_from_pb(public_key):
+            return False
+        return ecdsa_verify(public_key, self.serialize_unsigned(), self.programs[0].parameter)
+
     def serialize_unsigned(self):
+        _key = self._cache_key()
+        if self._cache is None or self._cache[0] != _key:
+            self._cache = (_key, self._serialize_unsigned(), None)
+        return self._cache[1]
+
+    def _serialize_unsigned(self):
         data_list = []
-        data_list.append(struct.pack('B', self.tx_type))
-        data_list.append(struct.pack('B', self.payload_version))
+        if self.version >= TxVersion09:
+            data_list.append(_uint8.pack(self.version))
+        data_list.append(_uint8.pack(self.tx_type))
+        data_list.append(_uint8.pack(self.payload_version))
         data_list.append(self.payload.serialize())
         data_list.append(Serialize.serialize_variable_int(len(self.attributes)))
         for attribute in self.attributes:
@@ -241,8 +316,8 @@ class Transaction:
 
         data_list.append(Serialize.serialize_variable_int(len(self.outputs)))
         for output in self.outputs:
-            data_list.append(output.serialize())
-        data_list.append(struct.pack("<L", self.lock_time))
+            data_list.append(output.serialize(self.version))
+        data_list.append(_uint32.pack(self.lock_time))
         return b''.join(data_list)
 
     def serialize(self):
@@ -255,7 +330,7 @@ class Transaction:
 
     def serialize_size(self):
         data_size = 0
-        data_size += 2
+        data_size += 3 if self.version >= TxVersion09 else 2
         data_size += p.Payload.serialize_size(self.payload)
         count_attributes = len(self.attributes)
         data_size += Serialize.serialize_variable_int_size(count_attributes)
@@ -266,7 +341,8 @@ class Transaction:
         data_size += Serialize.serialize_variable_int_size(count_inputs) + count_inputs * TxInput.serialize_size()
 
         count_outputs = len(self.outputs)
-        data_size += Serialize.serialize_variable_int_size(count_outputs) + count_outputs * TxOutput.serialize_size()
+        data_size += Serialize.serialize_variable_int_size(count_outputs) + count_outputs * TxOutput.serialize_size(
+            self.version)
 
         data_size += 4
         count_programs = len(self.programs)
@@ -277,36 +353,39 @@ class Transaction:
 
     @staticmethod
     def unserialize(data):
-        tx_type = data[0]
-        payload_version = data[1]
-        payload, data = p.Payload.unserialize(data[2:], tx_type, payload_version)
-        count_attribute, data = Serialize.unserialize_variable_int(data)
+        reader = ByteReader(data)
+        return Transaction.read(reader), reader.rest()
+
+    @staticmethod
+    def read(reader: ByteReader):
+        version = TxVersionDefault
+        if reader.peek_uint8() >= TxVersion09:
+            version = reader.read_uint8()
+        tx_type = reader.read_uint8()
+        payload_version = reader.read_uint8()
+        payload = p.Payload.read(reader, tx_type, payload_version)
+        count_attribute = reader.read_variable_int()
         attributes = []
         for i in range(count_attribute):
-            attribute, data = Attribute.unserialize(data)
-            attributes.append(attribute)
+            attributes.append(Attribute.read(reader))
 
-        num_inputs, data = Serialize.unserialize_variable_int(data)
+        num_inputs = reader.read_variable_int()
         inputs = []
         for i in range(num_inputs):
-            tx_input, data = TxInput.unserialize(data)
-            inputs.append(tx_input)
+            inputs.append(TxInput.read(reader))
 
         outputs = []
-        num_outputs, data = Serialize.unserialize_variable_int(data)
+        num_outputs = reader.read_variable_int()
         for i in range(num_outputs):
-            tx_output, data = TxOutput.unserialize(data)
-            outputs.append(tx_output)
-        lock_time = struct.unpack("<L", data[:4])[0]
+            outputs.append(TxOutput.read(reader, version))
+        lock_time = reader.read_uint32()
 
-        count_program, data = Serialize.unserialize_variable_int(data[4:])
+        count_program = reader.read_variable_int()
         programs = []
         for i in range(count_program):
-            program, data = p.Program.unserialize(data)
-            programs.append(program)
-        tx = Transaction(tx_type=tx_type, payload_version=payload_version, payload=payload, attributes=attributes,
-                         inputs=inputs, outputs=outputs, lock_time=lock_time, programs=programs)
-        return tx, data
+            programs.append(Program.read(reader))
+        return Transaction(tx_type=tx_type, payload_version=payload_version, payload=payload, attributes=attributes,
+                           inputs=inputs, outputs=outputs, lock_time=lock_time, programs=programs, version=version)
 
     def __str__(self):
         s = '<\n\t{},\n\t{},\n\t{},\n\t{},\n\t{},\n\t{},\n\t{},\n\t{}>'.format('type:{}'.format(self.tx_type),
@@ -330,42 +409,24 @@ class Transaction:
         return util.replace_angle_brackets(s)
 
 
-def ecdsa_verify(private_key: str, data: str, signature: str):
-    if len(signature) != 128:
+def ecdsa_verify(public_key: str, data, signature: str) -> bool:
+    """
+    Verify the signature of the sha256 of the data, see signer.verify
+    :param public_key: The public key in hex
+    :param data: The signed data, in bytes or hex
+    :param signature: r and s in hex, with or without the length prefix
+    :return: True if the signature is valid
+    """
+    try:
+        signature = bytes.fromhex(signature)
+    except ValueError:
         return False
-    private_key = bytes.fromhex(private_key)
-    data = bytes.fromhex(data)
-    signature = bytes.fromhex(signature)
-
-    r = int.from_bytes(signature[:32], byteorder="big", signed=False)
-    s = int.from_bytes(signature[32:], byteorder="big", signed=False)
-    data_hash = hashlib.sha256(data).digest()
-
-    secret = int.from_bytes(private_key, byteorder="big", signed=False)
-    digest = int.from_bytes(data_hash, byteorder="big", signed=False)
-    pub_key = ecdsa.ecdsa.Public_key(generator, generator * secret)
-    print(type(pub_key), pub_key)
-    sig = ecdsa.ecdsa.Signature(r, s)
-
-    return pub_key.verifies(digest, sig)
+    return signer.verify(public_key, data, signature)
 
 
 def ecdsa_sign(private_key: str, data):
-    if isinstance(data, str):
-        data = bytes.fromhex(data)
-    private_key = bytes.fromhex(private_key)
-    data_hash = hashlib.sha256(data).digest()
-
-    n = generator.order()
-
-    randrange = random.SystemRandom().randrange
-    secret = int.from_bytes(private_key, byteorder="big", signed=False)
-    digest = int.from_bytes(data_hash, byteorder="big", signed=False)
-    pub_key = ecdsa.ecdsa.Public_key(generator, generator * secret)
-    pri_key = ecdsa.ecdsa.Private_key(pub_key, secret)
-
-    signature = pri_key.sign(digest, randrange(1, n))
-    r = signature.r.to_bytes(32, byteorder="big", signed=False)
-    s = signature.s.to_bytes(32, byteorder="big", signed=False)
-
-    return struct.pack("B", len(r + s)) + r + s
+    """
+    Sign the sha256 of the data, the key is loaded once and reused by the later calls, see signer.Signer
+    :return: The signature, the length of r and s, then r and s
+    """
+    return signer.get_signer(private_key).sign(data)